@@ -2,35 +2,240 @@ import pandas as pd
 import numpy as np
 import scipy.sparse as sp
 import matplotlib.cm as cm
-import networkx as nx
+from collections import deque
 from networkx.algorithms import bipartite
 from networkx.algorithms.community import girvan_newman
 
-# Load the data
-df = pd.read_csv(r"July-Sept_Lumbra_filtered.csv")
-
-# Extract unique players and ECO codes
-players = df['Player'].unique()
-eco_codes = df['ECO Code'].unique()
-
-# Create mappings for player and ECO code indices
-player_index = {player: idx for idx, player in enumerate(players)}
-eco_index = {opening: idx for idx, opening in enumerate(eco_codes)}
+# pyarrow is only needed to read Parquet input
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Rows of the player/ECO file read at once by build_player_opening_matrix
+MATRIX_CHUNK_SIZE = 1_000_000
+
+# RollingCooccurrence recomputes W* from the whole window unless the rows of the players in the entering and
+# leaving periods hold less than this share of M's nonzeros (counted before and after the period)
+REBUILD_FRACTION = 0.25
+
+
+def _factorize_codes(codes, names):
+    # Renumber dictionary codes like pd.factorize numbers the CSV values: in order of first appearance and
+    # without the dictionary entries no row uses, which would otherwise become empty rows or columns
+    codes, used = pd.factorize(codes)
+    return codes, [names[int(code)] for code in used]
+
+
+def iter_player_opening_chunks(path, chunksize=MATRIX_CHUNK_SIZE):
+    # Yield (player codes, player names, eco codes, eco names) per chunk of the file, codes index the chunk's names
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            yield (*_factorize_codes(data["player"], list(data["player_names"])),
+                   *_factorize_codes(data["eco"], list(data["eco_names"])))
+        return
+
+    if path.endswith(".parquet"):
+        if pa is None:
+            raise ImportError("pyarrow is required to read Parquet input")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=["Player", "ECO Code"]):
+            chunk = []
+            for column in batch.columns:
+                if isinstance(column, pa.DictionaryArray):
+                    chunk += _factorize_codes(column.indices.to_numpy(zero_copy_only=False), column.dictionary.to_pylist())
+                else:
+                    codes, names = pd.factorize(column.to_numpy(zero_copy_only=False))
+                    chunk += [codes, list(names)]
+            yield tuple(chunk)
+        return
+
+    for frame in pd.read_csv(path, usecols=["Player", "ECO Code"], chunksize=chunksize):
+        player_codes, player_names = pd.factorize(frame["Player"])
+        eco_codes, eco_names = pd.factorize(frame["ECO Code"])
+        yield player_codes, list(player_names), eco_codes, list(eco_names)
+
+
+def _sum_triplets(keys, counts):
+    # Merge duplicate (row << 32 | col) keys, summing their counts
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+def build_player_opening_matrix(path, weighting="binary", chunksize=MATRIX_CHUNK_SIZE, player_index=None, eco_index=None,
+                                rca_threshold=None):
+    # Player x opening CSR matrix streamed from the CSV/Parquet/npz of ParsePGN, without loading the whole file.
+    # weighting is "binary" (played the opening), "count" (games) or "rca", the revealed comparative advantage
+    # (c_po / c_p) / (c_o / c), binarized as RCA >= rca_threshold when one is given.
+    # player_index and eco_index map names to rows/columns, existing maps are reused and new names appended.
+    # Triplets are summed per chunk and compacted as they grow, peak memory stays near the final nnz
+    player_index = {} if player_index is None else player_index
+    eco_index = {} if eco_index is None else eco_index
+
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    pending_keys = []
+    pending_counts = []
+    pending = 0
+
+    for player_codes, player_names, eco_codes, eco_names in iter_player_opening_chunks(path, chunksize):
+        # Chunk codes -> global indexes, names are added in order of first appearance. Every name of a chunk
+        # occurs in its rows, so no player or opening gets an empty row or column
+        player_map = np.array([player_index.setdefault(name, len(player_index)) for name in player_names] + [-1], dtype=np.int64)
+        eco_map = np.array([eco_index.setdefault(name, len(eco_index)) for name in eco_names] + [-1], dtype=np.int64)
+        rows = player_map[player_codes]
+        cols = eco_map[eco_codes]
+
+        # Missing values are coded -1 and map to the trailing -1
+        valid = (rows >= 0) & (cols >= 0)
+        chunk_keys, chunk_counts = _sum_triplets(rows[valid] << 32 | cols[valid], np.ones(valid.sum()))
+        pending_keys.append(chunk_keys)
+        pending_counts.append(chunk_counts)
+        pending += len(chunk_keys)
+
+        if pending > len(keys):
+            keys, counts = _sum_triplets(np.concatenate([keys] + pending_keys), np.concatenate([counts] + pending_counts))
+            pending_keys, pending_counts, pending = [], [], 0
+
+    keys, counts = _sum_triplets(np.concatenate([keys] + pending_keys), np.concatenate([counts] + pending_counts))
+    shape = (len(player_index), len(eco_index))
+    rows = keys >> 32
+    cols = keys & 0xFFFFFFFF
+
+    if weighting == "binary":
+        data = np.ones(len(keys), dtype=int)
+    elif weighting == "count":
+        data = counts
+    elif weighting == "rca":
+        player_totals = np.bincount(rows, weights=counts, minlength=shape[0])
+        eco_totals = np.bincount(cols, weights=counts, minlength=shape[1])
+        data = (counts / player_totals[rows]) / (eco_totals[cols] / counts.sum())
+        if rca_threshold is not None:
+            keep = data >= rca_threshold
+            rows, cols, data = rows[keep], cols[keep], np.ones(keep.sum(), dtype=int)
+    else:
+        raise ValueError("Unknown weighting: " + weighting)
+
+    M = sp.coo_matrix((data, (rows, cols)), shape=shape).tocsr()
+    return M, player_index, eco_index
+
+
+def zscore_filter(W_star, uo, P, threshold=3):
+    # Keep the co-occurrences whose Z-score against the expected uo_i * uo_j / P is above threshold.
+    # Only the stored entries of W_star are scored: a zero co-occurrence is never kept, so nothing
+    # O x O is built and memory stays proportional to nnz
+    W_star = sp.csr_matrix(W_star)
+    rows = np.repeat(np.arange(W_star.shape[0]), np.diff(W_star.indptr))
+    cols = W_star.indices
+    observed = W_star.data
+
+    uo = np.asarray(uo, dtype=np.float64)
+    expected = uo[rows] * uo[cols] / P
+    Z_scores = (observed - expected) / np.sqrt(expected)
+
+    keep = Z_scores > threshold
+    return sp.csr_matrix((observed[keep], (rows[keep], cols[keep])), shape=W_star.shape)
+
+
+class RollingCooccurrence:
+    # W*, uo and dp of a sliding window over periods (e.g. months), updated as periods enter and leave.
+    # Each period is a player x opening count matrix from build_player_opening_matrix(..., weighting="count")
+    # built with shared player_index/eco_index. The window's M is the binary or count weighting of the summed
+    # period counts. W* = M.T @ M is a sum over players, so it can be updated from the rows of the players in the
+    # entering or leaving period alone. That update costs about as much per nonzero as the full product, it is only
+    # used when those rows are a small part of M (see REBUILD_FRACTION) and W* is recomputed otherwise
+    def __init__(self, window, weighting="binary", threshold=3):
+        if weighting not in ("binary", "count"):
+            raise ValueError("Rolling windows support the binary and count weightings, not " + weighting)
+        self.window = window
+        self.weighting = weighting
+        self.threshold = threshold
+        # (label, counts) of the periods in the window, oldest first
+        self.periods = deque()
+        self.counts = sp.csr_matrix((0, 0), dtype=np.int64)
+        self.W_star = sp.csr_matrix((0, 0), dtype=np.int64)
+        self.uo = np.zeros(0, dtype=np.int64)
+        self.dp = np.zeros(0, dtype=np.int64)
+
+    def _weighted(self, counts):
+        return (counts > 0).astype(np.int64) if self.weighting == "binary" else counts
+
+    def _resize(self, shape):
+        # Later periods can add players and openings to the shared indexes
+        P, O = max(shape[0], self.counts.shape[0]), max(shape[1], self.counts.shape[1])
+        if (P, O) != self.counts.shape:
+            self.counts.resize((P, O))
+            self.W_star.resize((O, O))
+            self.uo = np.pad(self.uo, (0, O - len(self.uo)))
+            self.dp = np.pad(self.dp, (0, P - len(self.dp)))
+        return P, O
+
+    def push(self, label, counts):
+        # Add the next period, drop the oldest one once the window is full, and return the window's W_filtered
+        counts = sp.csr_matrix(counts, dtype=np.int64, copy=True)
+        shape = self._resize(counts.shape)
+        counts.resize(shape)
+        self.periods.append((label, counts))
+
+        delta = counts
+        if len(self.periods) > self.window:
+            _, leaving = self.periods.popleft()
+            leaving.resize(shape)
+            delta = delta - leaving
+
+        # Players whose window row changes, every other player's contribution to W* stays the same
+        delta.eliminate_zeros()
+        affected = np.flatnonzero(np.diff(delta.indptr))
+        affectedNnz = np.diff(self.counts.indptr)[affected].sum()
+        previous = self.counts
+        self.counts = self.counts + delta
+        self.counts.eliminate_zeros()
+        affectedNnz += np.diff(self.counts.indptr)[affected].sum()
+
+        if affectedNnz >= REBUILD_FRACTION * self.counts.nnz:
+            # The update multiplies every affected row before and after, one product over the window is cheaper
+            M = self._weighted(self.counts)
+            self.W_star = (M.T @ M).tocsr()
+            self.uo = np.asarray(M.sum(axis=0)).ravel()
+            self.dp = np.asarray(M.sum(axis=1)).ravel()
+        else:
+            # Entries of M that appeared, disappeared or changed weight with this period
+            before = self._weighted(previous[affected])
+            after = self._weighted(self.counts[affected])
+            change = after - before
+            change.eliminate_zeros()
+
+            # after.T @ after - before.T @ before = (S + S.T) / 2 with S = change.T @ (after + before)
+            S = change.T @ (after + before)
+            update = (S + S.T).tocsr()
+            update.data //= 2
+            self.W_star = self.W_star + update
+            self.W_star.eliminate_zeros()
+            self.uo += np.asarray(change.sum(axis=0)).ravel()
+            self.dp[affected] = np.asarray(after.sum(axis=1)).ravel()
+
+        return self.filtered()
+
+    def labels(self):
+        return [label for label, _ in self.periods]
+
+    def active_players(self):
+        # Players with at least one game in the window, P of the Z-scores
+        return int(np.count_nonzero(self.dp))
+
+    def filtered(self):
+        return zscore_filter(self.W_star, self.uo, self.active_players(), self.threshold)
+
+
+# Build the player x opening matrix straight from the file in chunks, players and ECO codes are
+# indexed in order of first appearance
+M, player_index, eco_index = build_player_opening_matrix(r"July-Sept_Lumbra_filtered.csv", weighting="binary")
+players = list(player_index)
+eco_codes = list(eco_index)
 
 P = len(players)
 O = len(eco_codes)
 
-# Initialize a sparse matrix due to size
-M = sp.lil_matrix((P, O), dtype=int)
-
-# Vectorized assignment to the sparse matrix
-player_indices = df['Player'].map(player_index)
-eco_indices = df['ECO Code'].map(eco_index)
-M[player_indices, eco_indices] = 1
-
-# Convert to CSR format for efficiency
-M = M.tocsr()
-
 # print("Players:", players)
 # print("Openings:", eco_codes)
 # print("Matrix M:\n", M.toarray()) 
@@ -79,24 +284,14 @@ dp = np.asarray(M.sum(axis=1)).flatten()  # Summing over columns, converting to
 # Calculate ubiquity (uo) for each opening
 uo = np.asarray(M.sum(axis=0)).flatten()  # Summing over rows, converting to dense array
 
-# Calculate the expected co-occurrence for each pair of openings
 P = M.shape[0]  # Number of players
-expected = np.outer(uo, uo) / P
 
 # Calculate the observed co-occurrence W* matrix
 W_star = M.T @ M  # Sparse matrix multiplication, gives the W* matrix of shape (O, O)
 
-# Calculate Z-scores for each pair of openings
-std_dev = np.sqrt(expected)  
-
-# Convert to dense if necessary when performing the subtraction
-observed = W_star.toarray() if sp.issparse(W_star) else W_star
-
-Z_scores = (observed - expected) / std_dev
-
-# Filter the Z-scores
+# Filter the Z-scores, expected values are only computed where W* is nonzero
 threshold = 3
-W_filtered = sp.csr_matrix(np.where(Z_scores > threshold, observed, 0))
+W_filtered = zscore_filter(W_star, uo, P, threshold)
 
 # W_filtered remains sparse; convert to dense only if required for final inspection:
 # W_filtered_dense = W_filtered.toarray()
@@ -143,48 +338,58 @@ plt.show()
 
 
 
+#NOTE Rolling windows
+# Monthly count matrices over shared indexes, one filtered network per 3 month window
+
+# rolling_player_index, rolling_eco_index = {}, {}
+# rolling = RollingCooccurrence(window=3, weighting="binary", threshold=3)
+# for month in ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep"]:
+#     counts, _, _ = build_player_opening_matrix(month + "_Lumbra_filtered.csv", weighting="count",
+#                                                player_index=rolling_player_index, eco_index=rolling_eco_index)
+#     W_window = rolling.push(month, counts)
+#     print(rolling.labels(), rolling.active_players(), W_window.nnz)
+
+
+
 #NOTE Build relatedness network
 import igraph as ig
 import leidenalg as la
-import networkx as nx
 import matplotlib.pyplot as plt
-from networkx.algorithms.community import louvain_communities
-
-# Create a graph from the filtered W* matrix
-G = nx.Graph()
+from matplotlib.collections import LineCollection
 
-# Add nodes (each node is an opening)
-num_openings = W_filtered.shape[0]
-G.add_nodes_from(range(num_openings))
+# Each opening is a node, edges are the statistically significant co-occurrences.
+# The upper triangle holds every undirected edge once and no self-loops
+upper = sp.triu(W_filtered, k=1, format="csr")
+sources = np.repeat(np.arange(upper.shape[0]), np.diff(upper.indptr))
+edges = np.column_stack([sources, upper.indices])
 
-# Add edges (only adds edges for statistically significant co-occurrences)
-rows, cols = W_filtered.nonzero()
-for i, j in zip(rows, cols):
-    if i < j:  # Ensure duplicate edges and self-loops aren't added
-        G.add_edge(i, j, weight=W_filtered[i, j])
+# Opening labels in node order, through the eco_index used to build M
+labels = [None] * upper.shape[0]
+for opening, idx in eco_index.items():
+    labels[idx] = opening
 
-# Convert the NetworkX graph to an iGraph object to more easily use Leiden Algorithm
-G_ig = ig.Graph.TupleList(G.edges(data=True), directed=False, edge_attrs=['weight'])
+G_ig = ig.Graph(n=upper.shape[0], edges=edges, vertex_attrs={"name": labels},
+                edge_attrs={"weight": upper.data.astype(float).tolist()})
 
-# Detect communities using the Leiden algorithm
-partition = la.find_partition(G_ig, la.ModularityVertexPartition)
+# Detect communities using the Leiden algorithm on the weighted graph
+partition = la.find_partition(G_ig, la.ModularityVertexPartition, weights="weight")
 
-# Map iGraph communities back to NetworkX nodes
-node_community_map = {}
-for idx, community in enumerate(partition):
-    for node in community:
-        node_community_map[G_ig.vs[node]["name"]] = idx
+# Openings of each community, by label
+communities = [[labels[node] for node in community] for community in partition]
+# for idx, community in enumerate(communities):
+#     print(idx, community)
 
-# Create a list of colors corresponding to each node’s community
-node_colors = [node_community_map.get(node, -1) for node in G.nodes()]
+# Community of each node, used as its color
+node_colors = partition.membership
 
 # Use a force-directed layout for better separation
-pos = nx.spring_layout(G, k=0.6, iterations=100, seed=1)
+pos = np.array(G_ig.layout_fruchterman_reingold(weights="weight", niter=100).coords)
 
 # Draw the graph
-plt.figure(figsize=(14, 10))
-nx.draw_networkx_nodes(G, pos, node_color=node_colors, cmap=plt.cm.tab10, node_size=15)
-nx.draw_networkx_edges(G, pos, alpha=0.2)
+fig, ax = plt.subplots(figsize=(14, 10))
+ax.add_collection(LineCollection(pos[edges], colors="black", alpha=0.2, linewidths=0.5))
+ax.scatter(pos[:, 0], pos[:, 1], c=node_colors, cmap=plt.cm.tab10, s=15, zorder=2)
+ax.set_axis_off()
 
 plt.title('Communities in Chess Opening Network (Leiden Algorithm)')
 plt.show()
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import chess.pgn
+from ParsePGN import GameHeaders, is_compressed, scan_headers
+
+
+class GameIndex:
+    # Persistent SQLite index of a PGN file: game number -> byte offset, ECO code and date,
+    # with the games of each player looked up through an index instead of reading the whole file
+    def __init__(self, index_path):
+        self.connection = sqlite3.connect(index_path)
+
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS source (
+                    pgn_file_path TEXT NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS players (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS games (
+                    game_no INTEGER PRIMARY KEY,
+                    byte_offset INTEGER NOT NULL,
+                    white_id INTEGER NOT NULL,
+                    black_id INTEGER NOT NULL,
+                    eco_code TEXT NOT NULL,
+                    game_date TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS games_white ON games (white_id);
+                CREATE INDEX IF NOT EXISTS games_black ON games (black_id);
+            """)
+
+    def close(self):
+        self.connection.close()
+
+    @classmethod
+    def build(cls, index_path, pgn_file_path, workers=1, headers=None):
+        # Replace the index contents with the games of pgn_file_path, headers can be passed to reuse an earlier scan
+        if is_compressed(pgn_file_path):
+            raise ValueError("Game offsets can only be indexed for uncompressed PGN files: " + pgn_file_path)
+
+        if headers is None:
+            headers = scan_headers(pgn_file_path, workers)
+        index = cls(index_path)
+        index.add_headers(pgn_file_path, headers)
+        return index
+
+    def add_headers(self, pgn_file_path, headers: GameHeaders):
+        eco_codes = headers.ecoCodes.values
+        dates = headers.dates.values
+
+        with self.connection:
+            self.connection.execute("DELETE FROM source")
+            self.connection.execute("DELETE FROM players")
+            self.connection.execute("DELETE FROM games")
+            self.connection.execute("INSERT INTO source VALUES (?, ?)",
+                                    (os.path.abspath(pgn_file_path), os.path.getsize(pgn_file_path)))
+            # Player ids are the scan's codes
+            self.connection.executemany("INSERT INTO players VALUES (?, ?)", enumerate(headers.players.values))
+            self.connection.executemany(
+                "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?)",
+                ((game_no, offset, white_player, black_player, eco_codes[eco_code], dates[game_date])
+                 for game_no, (offset, white_player, black_player, eco_code, game_date)
+                 in enumerate(zip(headers.offsets, headers.white, headers.black, headers.eco, headers.date))))
+
+    def pgn_file_path(self):
+        row = self.connection.execute("SELECT pgn_file_path, size FROM source").fetchone()
+        if row is None:
+            raise ValueError("The game index is empty")
+        pgn_file_path, size = row
+        if os.path.getsize(pgn_file_path) != size:
+            raise ValueError("The PGN file changed since it was indexed: " + pgn_file_path)
+        return pgn_file_path
+
+    def game(self, game_no):
+        # (byte_offset, eco_code, game_date) of a game number
+        return self.connection.execute(
+            "SELECT byte_offset, eco_code, game_date FROM games WHERE game_no = ?", (game_no,)).fetchone()
+
+    def player_games(self, player, color=None):
+        # [(game_no, byte_offset, color, eco_code, game_date)] in file order, color is "White", "Black" or None for both
+        row = self.connection.execute("SELECT id FROM players WHERE name = ?", (player,)).fetchone()
+        if row is None:
+            return []
+
+        games = []
+        for column, name in (("white_id", "White"), ("black_id", "Black")):
+            if color is None or color == name:
+                games.extend((game_no, byte_offset, name, eco_code, game_date) for game_no, byte_offset, eco_code, game_date
+                             in self.connection.execute(
+                                 "SELECT game_no, byte_offset, eco_code, game_date FROM games WHERE " + column + " = ?",
+                                 row))
+        games.sort()
+        return games
+
+    def read_games(self, game_nos):
+        # Seek straight to each game and parse it with chess.pgn, yields (game_no, game)
+        with open(self.pgn_file_path(), 'r', encoding="utf-8", errors="replace") as pgnFile:
+            for game_no in game_nos:
+                byte_offset = self.game(game_no)[0]
+                pgnFile.seek(byte_offset)
+                yield game_no, chess.pgn.read_game(pgnFile)
+
+    def read_player_games(self, player, color=None):
+        return self.read_games([game[0] for game in self.player_games(player, color)])
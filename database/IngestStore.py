@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import pandas as pd
+from collections import defaultdict
+from ParsePGN import count_games, scan_byte_range
+
+
+class IngestStore:
+    # Local SQLite store that keeps per-player White/Black game counts, the headers of every
+    # scanned game with an Opening tag and a byte-offset checkpoint per PGN file, so new months of
+    # games can be added without rescanning the whole history
+    def __init__(self, store_path, min_white_games, min_black_games):
+        self.connection = sqlite3.connect(store_path)
+        self.min_white_games = min_white_games
+        self.min_black_games = min_black_games
+
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS players (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL,
+                    white INTEGER NOT NULL,
+                    black INTEGER NOT NULL,
+                    qualified INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS games (
+                    file_id TEXT NOT NULL,
+                    white_id INTEGER NOT NULL,
+                    black_id INTEGER NOT NULL,
+                    eco_code TEXT NOT NULL,
+                    opening_name TEXT NOT NULL,
+                    game_date TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS games_white ON games (white_id);
+                CREATE INDEX IF NOT EXISTS games_black ON games (black_id);
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    file_id TEXT PRIMARY KEY,
+                    byte_offset INTEGER NOT NULL,
+                    games INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+
+        # Counts are small enough to keep in memory between runs, name -> [id, white, black, qualified]
+        self.players = {}
+        self.names = {}
+        for player_id, name, white, black, qualified in self.connection.execute(
+                "SELECT id, name, white, black, qualified FROM players"):
+            self.players[name] = [player_id, white, black, bool(qualified)]
+            self.names[player_id] = name
+
+    def close(self):
+        self.connection.close()
+
+    def checkpoint(self, file_id):
+        row = self.connection.execute("SELECT byte_offset, games FROM checkpoints WHERE file_id = ?", (file_id,)).fetchone()
+        return row if row else (0, 0)
+
+    def counts(self):
+        white_games = defaultdict(int)
+        black_games = defaultdict(int)
+        for name, (_, white, black, _) in self.players.items():
+            white_games[name] = white
+            black_games[name] = black
+        return white_games, black_games
+
+    def qualifying_players(self):
+        return {name for name, player in self.players.items() if player[3]}
+
+    def ingest(self, pgn_file_path, file_id=None):
+        # Scan only the bytes of pgn_file_path past its checkpoint and update the counts in place.
+        # Returns the rows to add to the output (the same dicts as extract_game_data): the new games
+        # of qualifying players plus the earlier games of players that qualify for the first time,
+        # together with the sets of newly qualified and disqualified players
+        if file_id is None:
+            file_id = os.path.abspath(pgn_file_path)
+        byte_offset, games = self.checkpoint(file_id)
+
+        headers = scan_byte_range(pgn_file_path, start=byte_offset)
+        white_games, black_games = count_games(headers)
+
+        changed = set(white_games) | set(black_games)
+        # Thresholds changed since the last run, every player has to be re-evaluated
+        if self._thresholds_changed():
+            changed.update(self.players)
+
+        for name, n in white_games.items():
+            self._player(name)[1] += n
+        for name, n in black_games.items():
+            self._player(name)[2] += n
+
+        newly_qualified = set()
+        disqualified = set()
+        for name in changed:
+            player = self.players[name]
+            qualified = player[1] >= self.min_white_games and player[2] >= self.min_black_games
+            if qualified and not player[3]:
+                newly_qualified.add(name)
+            elif player[3] and not qualified:
+                disqualified.add(name)
+            player[3] = qualified
+
+        with self.connection:
+            # Earlier games of players that qualify now, read before this scan's games are stored
+            data = self._stored_rows({self.players[name][0] for name in newly_qualified})
+
+            ids = [self.players[name][0] for name in headers.players.values]
+            eco_codes = headers.ecoCodes.values
+            openings = headers.openings.values
+            dates = headers.dates.values
+            # Only games with an Opening tag are kept, the others are never emitted as rows
+            games_rows = [(file_id, ids[white_player], ids[black_player],
+                           eco_codes[eco_code], openings[opening_name], dates[game_date])
+                          for white_player, black_player, eco_code, opening_name, game_date, has_opening
+                          in zip(headers.white, headers.black, headers.eco, headers.opening, headers.date,
+                                 headers.hasOpening) if has_opening]
+            self.connection.executemany("INSERT INTO games VALUES (?, ?, ?, ?, ?, ?)", games_rows)
+
+            for _, white_id, black_id, eco_code, opening_name, game_date in games_rows:
+                self._add_rows(data, white_id, black_id, eco_code, opening_name, game_date)
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO players (id, name, white, black, qualified) VALUES (?, ?, ?, ?, ?)",
+                [(self.players[name][0], name, self.players[name][1], self.players[name][2], int(self.players[name][3]))
+                 for name in changed])
+            self.connection.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                                    (file_id, headers.endOffset, games + len(headers)))
+            self.connection.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                                        [("min_white_games", self.min_white_games),
+                                         ("min_black_games", self.min_black_games)])
+
+        return data, newly_qualified, disqualified
+
+    def _player(self, name):
+        player = self.players.get(name)
+        if player is None:
+            player_id = len(self.players) + 1
+            player = [player_id, 0, 0, False]
+            self.players[name] = player
+            self.names[player_id] = name
+        return player
+
+    def _thresholds_changed(self):
+        settings = dict(self.connection.execute("SELECT key, value FROM settings"))
+        if not settings:
+            return False
+        return (settings["min_white_games"], settings["min_black_games"]) != (self.min_white_games, self.min_black_games)
+
+    def _add_rows(self, data, white_id, black_id, eco_code, opening_name, game_date, only_ids=None):
+        # Same rows extract_game_data emits for a game, restricted to only_ids when given
+        for player_id, color in ((white_id, "White"), (black_id, "Black")):
+            if only_ids is not None and player_id not in only_ids:
+                continue
+            name = self.names[player_id]
+            if self.players[name][3]:
+                data.append({
+                    "Player": name,
+                    "Color": color,
+                    "ECO Code": eco_code,
+                    "Opening ": opening_name,
+                    "Date": game_date
+                })
+
+    def _stored_rows(self, player_ids):
+        data = []
+        if not player_ids:
+            return data
+
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS requalified (id INTEGER PRIMARY KEY)")
+        self.connection.execute("DELETE FROM requalified")
+        self.connection.executemany("INSERT INTO requalified VALUES (?)", [(player_id,) for player_id in player_ids])
+        for white_id, black_id, eco_code, opening_name, game_date in self.connection.execute("""
+                SELECT white_id, black_id, eco_code, opening_name, game_date FROM games
+                WHERE white_id IN (SELECT id FROM requalified) OR black_id IN (SELECT id FROM requalified)
+                ORDER BY rowid"""):
+            self._add_rows(data, white_id, black_id, eco_code, opening_name, game_date, player_ids)
+        return data
+
+
+def append_csv(data, output_csv):
+    # Append the rows returned by IngestStore.ingest to a create_csv output file
+    df = pd.DataFrame(data, columns=["Player", "Color", "ECO Code", "Opening ", "Date"])
+    df.to_csv(output_csv, mode="a", index=False, header=not os.path.exists(output_csv))
@@ -1,24 +1,357 @@
+import bz2
+import csv
+import gzip
+import io
+import os
+import numpy as np
 import pandas as pd
-from collections import defaultdict
-
-
-def count_games(pgn_file_path):
-    # Initialize dictionaries to count games played by each player as White and Black
-    white_games = defaultdict(int)
-    black_games = defaultdict(int)
-    
-    with open(pgn_file_path, 'r') as pgnFile:
-        for line in pgnFile:
-            line = line.strip()
-            
-            if line.startswith("[White "):
-                white_player = line.split('"')[1]
-            elif line.startswith("[Black "):
-                black_player = line.split('"')[1]
-            elif line == "":  # End of a game
-                white_games[white_player] += 1
-                black_games[black_player] += 1
-    
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+# zstandard is only needed for the .zst Lichess dumps
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# pyarrow is only needed to write Parquet output
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# Size of the binary reads used by the header scanner
+READ_CHUNK_SIZE = 1 << 24
+
+# Lichess dumps are compressed with a long window, allow up to 2 GiB
+ZSTD_MAX_WINDOW_SIZE = 1 << 31
+
+# Rows per batch (Parquet row group) written by create_columnar
+ROW_BATCH_SIZE = 1 << 20
+
+# Values of the Color column in the columnar output
+COLORS = ["White", "Black"]
+
+# Games buffered between COPY flushes in parse_pgn_update_db
+DB_BATCH_SIZE = 10000
+
+# Header tags the scanner keeps, mapped to their column in GameHeaders
+HEADER_FIELDS = {b"[White": 0, b"[Black": 1, b"[ECO": 2, b"[Opening": 3, b"[Date": 4}
+
+
+class StringTable:
+    # Interns header values so each game only stores an integer code per field
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, raw):
+        code = self.codes.get(raw)
+        if code is None:
+            code = len(self.values)
+            self.codes[raw] = code
+            self.values.append(raw.decode("utf-8", "replace"))
+        return code
+
+    def lookup(self, value):
+        return self.codes.get(value.encode("utf-8"))
+
+    def remap(self, other):
+        # Codes of another table's values in this table, indexed by the other table's codes
+        return [self.code(raw) for raw in other.codes]
+
+
+class GameHeaders:
+    # Columnar store of (white, black, ECO, opening, date) for every game of a PGN file.
+    # Built in a single pass by scan_headers, counting and row emission read from it instead of the file.
+    def __init__(self):
+        # Byte offset (in the decompressed stream) where the scan stopped
+        self.endOffset = 0
+
+        self.players = StringTable()
+        self.ecoCodes = StringTable()
+        self.openings = StringTable()
+        self.dates = StringTable()
+
+        # Byte offset of each game's [Event line
+        self.offsets = array("q")
+        self.white = array("l")
+        self.black = array("l")
+        self.eco = array("l")
+        self.opening = array("l")
+        self.date = array("l")
+        # 1 when the game has an Opening tag (even an empty one), only those games are emitted as rows
+        self.hasOpening = array("b")
+
+    def __len__(self):
+        return len(self.white)
+
+    def add_game(self, fields, offset):
+        # fields holds the raw header values in HEADER_FIELDS order, the opening is None without an Opening tag
+        self.offsets.append(offset)
+        self.white.append(self.players.code(fields[0]))
+        self.black.append(self.players.code(fields[1]))
+        self.eco.append(self.ecoCodes.code(fields[2]))
+        self.opening.append(self.openings.code(fields[3] or b""))
+        self.date.append(self.dates.code(fields[4]))
+        self.hasOpening.append(fields[3] is not None)
+
+    def extend(self, other):
+        # Append the games of another scan (a later shard of the same file), re-interning its codes
+        for column, table, otherColumn, otherTable in (
+                (self.white, self.players, other.white, other.players),
+                (self.black, self.players, other.black, other.players),
+                (self.eco, self.ecoCodes, other.eco, other.ecoCodes),
+                (self.opening, self.openings, other.opening, other.openings),
+                (self.date, self.dates, other.date, other.dates)):
+            codes = table.remap(otherTable)
+            column.extend(codes[code] for code in otherColumn)
+        self.offsets.extend(other.offsets)
+        self.hasOpening.extend(other.hasOpening)
+        self.endOffset = other.endOffset
+
+    def player_codes(self, players):
+        codes = set()
+        for player in players:
+            code = self.players.lookup(player)
+            if code is not None:
+                codes.add(code)
+        return codes
+
+
+def is_compressed(pgn_file_path):
+    return os.path.splitext(pgn_file_path)[1].lower() in (".zst", ".bz2", ".gz")
+
+
+def open_pgn(pgn_file_path):
+    # Open a PGN file as a binary stream, compressed files are decompressed while they are read
+    extension = os.path.splitext(pgn_file_path)[1].lower()
+    if extension == ".zst":
+        if zstandard is None:
+            raise ImportError("zstandard is required to read .zst PGN files")
+        decompressor = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_SIZE)
+        return decompressor.stream_reader(open(pgn_file_path, 'rb'), closefd=True)
+    if extension == ".bz2":
+        return bz2.open(pgn_file_path, 'rb')
+    if extension == ".gz":
+        return gzip.open(pgn_file_path, 'rb')
+    return open(pgn_file_path, 'rb')
+
+
+def open_pgn_text(pgn_file_path):
+    # Text stream for chess.pgn.read_game, also accepts compressed files
+    return io.TextIOWrapper(open_pgn(pgn_file_path), encoding="utf-8", errors="replace")
+
+
+def iter_lines(pgnFile, chunk_size=READ_CHUNK_SIZE, limit=None):
+    # Yield the lines of a binary stream, reading it in large chunks and stopping after limit bytes
+    remainder = b""
+    while limit is None or limit > 0:
+        chunk = pgnFile.read(chunk_size if limit is None else min(chunk_size, limit))
+        if not chunk:
+            break
+        if limit is not None:
+            limit -= len(chunk)
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def tag_value(value):
+    # The string of a tag line after its name, None without one. PGN strings escape quotes and backslashes as \" and \\
+    start = value.find(b'"')
+    if start == -1:
+        return None
+    if b"\\" not in value:
+        end = value.find(b'"', start + 1)
+        return value[start + 1:end] if end != -1 else None
+
+    unescaped = bytearray()
+    position = start + 1
+    while position < len(value):
+        byte = value[position:position + 1]
+        if byte == b'"':
+            return bytes(unescaped)
+        if byte == b"\\" and position + 1 < len(value):
+            position += 1
+            byte = value[position:position + 1]
+        unescaped += byte
+        position += 1
+    return None
+
+
+def scan_byte_range(pgn_file_path, start=0, end=None):
+    # Scan the games in [start, end), start must be the first byte of an [Event line
+    headers = GameHeaders()
+    fields = None
+    game_offset = position = start
+
+    with open_pgn(pgn_file_path) as pgnFile:
+        if start:
+            pgnFile.seek(start)
+        for line in iter_lines(pgnFile, limit=None if end is None else end - start):
+            line_offset = position
+            position += len(line) + 1
+
+            # Move text and blank lines never start with a tag
+            if not line.startswith(b"["):
+                continue
+
+            tag, _, value = line.partition(b" ")
+            if tag == b"[Event":
+                # A new game starts, store the previous one
+                if fields is not None:
+                    headers.add_game(fields, game_offset)
+                fields = [b"", b"", b"", None, b""]
+                game_offset = line_offset
+            elif fields is not None:
+                field = HEADER_FIELDS.get(tag)
+                if field is not None:
+                    quoted = tag_value(value)
+                    if quoted is not None:
+                        fields[field] = quoted
+
+        headers.endOffset = pgnFile.tell()
+
+    if fields is not None:
+        headers.add_game(fields, game_offset)
+
+    return headers
+
+
+def find_shard_offsets(pgn_file_path, num_shards):
+    # Split a PGN file into byte ranges that each start on an [Event line
+    size = os.path.getsize(pgn_file_path)
+    starts = [0]
+
+    with open(pgn_file_path, 'rb') as pgnFile:
+        for shard in range(1, num_shards):
+            position = max(size * shard // num_shards, starts[-1])
+            pgnFile.seek(position)
+            window = b""
+            # Read forward until the next game boundary
+            while True:
+                chunk = pgnFile.read(1 << 16)
+                if not chunk:
+                    position = size
+                    break
+                window += chunk
+                found = window.find(b"\n[Event ")
+                if found != -1:
+                    position += found + 1
+                    break
+                # Keep enough of the tail to catch a boundary split across reads
+                position += len(window) - 8
+                window = window[-8:]
+            if starts[-1] < position < size:
+                starts.append(position)
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def scan_headers(pgn_file_path, workers=1):
+    # workers=None uses every core, shards are merged in file order so the result matches the serial scan
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # Compressed streams can't be split into byte ranges and are always scanned serially
+    if workers <= 1 or is_compressed(pgn_file_path):
+        return scan_byte_range(pgn_file_path)
+
+    shards = find_shard_offsets(pgn_file_path, workers)
+    headers = GameHeaders()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard in executor.map(scan_byte_range, [pgn_file_path] * len(shards),
+                                  [start for start, _ in shards], [end for _, end in shards]):
+            headers.extend(shard)
+
+    return headers
+
+
+class HeaderFilter:
+    # Accepts a game from its tags alone: at least one player in players, ECO code in eco_codes and
+    # Date within [date_from, date_to] ("YYYY.MM.DD" strings compare in date order). None disables a check
+    def __init__(self, players=None, eco_codes=None, date_from=None, date_to=None):
+        self.players = players
+        self.eco_codes = eco_codes
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def __call__(self, tags):
+        if self.players is not None and tags.get("White") not in self.players and tags.get("Black") not in self.players:
+            return False
+        if self.eco_codes is not None and tags.get("ECO") not in self.eco_codes:
+            return False
+        date = tags.get("Date", "")
+        if self.date_from is not None and date < self.date_from:
+            return False
+        if self.date_to is not None and date > self.date_to:
+            return False
+        return True
+
+
+def iter_games(pgn_file_path, start=0, accept=None):
+    # Yield (byte_offset, end_offset, tags, movetext) for every game from start on, tags maps tag names to values.
+    # accept(tags) is called once the tags of a game are read, the move text of rejected games is skipped
+    # without being joined or decoded and the game isn't yielded
+    tags = None
+    accepted = None
+    movetext = []
+    game_offset = position = start
+
+    with open_pgn(pgn_file_path) as pgnFile:
+        if start:
+            pgnFile.seek(start)
+        for line in iter_lines(pgnFile):
+            line_offset = position
+            position += len(line) + 1
+
+            # Tags are only read until the move text starts (accepted is decided on its first line), later lines
+            # starting with "[" such as a wrapped "[%clk 0:03:00] }" comment belong to the move text
+            if line.startswith(b"[") and (accepted is None or line.startswith(b"[Event ")):
+                tag, _, value = line.partition(b" ")
+                if tag == b"[Event":
+                    if tags is not None and (accepted or (accepted is None and (accept is None or accept(tags)))):
+                        yield game_offset, line_offset, tags, b"\n".join(movetext).strip().decode("utf-8", "replace")
+                    tags = {}
+                    accepted = None
+                    movetext = []
+                    game_offset = line_offset
+                quoted = tag_value(value)
+                # Header lines without a quoted value are skipped
+                if tags is not None and quoted is not None:
+                    tags[tag[1:].decode("utf-8", "replace")] = quoted.decode("utf-8", "replace")
+            elif tags is not None:
+                # The first line after the tags decides whether the move text is kept
+                if accepted is None:
+                    accepted = accept is None or accept(tags)
+                if accepted:
+                    movetext.append(line)
+
+    if tags is not None and (accepted or (accepted is None and (accept is None or accept(tags)))):
+        yield game_offset, position, tags, b"\n".join(movetext).strip().decode("utf-8", "replace")
+
+
+def game_text(tags, movetext):
+    # PGN text of a game from iter_games for chess.pgn, which only needs the tags that change the starting position
+    if "FEN" in tags:
+        return '[SetUp "1"]\n[FEN "' + tags["FEN"] + '"]\n\n' + movetext
+    return movetext
+
+
+def count_games(pgn_file_path, workers=1):
+    # Accepts either a PGN path or the GameHeaders of an earlier scan
+    headers = pgn_file_path if isinstance(pgn_file_path, GameHeaders) else scan_headers(pgn_file_path, workers)
+    players = headers.players.values
+
+    # Count games played by each player as White and Black
+    white_games = defaultdict(int, {players[code]: n for code, n in Counter(headers.white).items()})
+    black_games = defaultdict(int, {players[code]: n for code, n in Counter(headers.black).items()})
+
     return white_games, black_games
 
 def filter_players(white_games, black_games, min_white_games, min_black_games):
@@ -29,100 +362,274 @@ def filter_players(white_games, black_games, min_white_games, min_black_games):
     return qualifying_players
 
 
-def extract_game_data(pgn_file_path, qualifying_players):
-    # Initialize dictionaries to count games played by each player as White and Black
+def extract_game_data(pgn_file_path, qualifying_players, workers=1):
+    # Accepts either a PGN path or the GameHeaders of an earlier scan
+    headers = pgn_file_path if isinstance(pgn_file_path, GameHeaders) else scan_headers(pgn_file_path, workers)
+    players = headers.players.values
+    eco_codes = headers.ecoCodes.values
+    openings = headers.openings.values
+    dates = headers.dates.values
+
+    # Compare integer codes instead of player names
+    qualifying_codes = headers.player_codes(qualifying_players)
     data = []
-    
-
-
-    # Second pass: extract data only for eligible players
-    with open(pgn_file_path, 'r') as pgnFile:
-        for line in pgnFile:
-            line = line.strip()
-            
-            if line.startswith("[Event "):
-                # When a new game starts, reset the variables
-                eco_code = ""
-                opening_name = ""
-                white_player = ""
-                black_player = ""
-                game_date = ""
-            elif line.startswith("[Date "):
-                game_date = line.split('"')[1]
-            elif line.startswith("[White "):
-                white_player = line.split('"')[1]
-            elif line.startswith("[Black "):
-                black_player = line.split('"')[1]
-            elif line.startswith("[ECO "):
-                eco_code = line.split('"')[1]
-            elif line.startswith("[Opening "):
-                opening_name = line.split('"')[1]
-
-
-                
-                # Only add data for eligible players
-                if white_player in qualifying_players and black_player in qualifying_players:
-                    data.append({
-                        "Player": white_player,
-                        "Color": "White",
-                        "ECO Code": eco_code,
-                        "Opening ": opening_name,
-                        "Date": game_date
-                    })
-                    data.append({
-                        "Player": black_player,
-                        "Color": "Black",
-                        "ECO Code": eco_code,
-                        "Opening ": opening_name,
-                        "Date": game_date
-                    })
-                    
-                elif black_player in qualifying_players and white_player not in qualifying_players:
-                    data.append({
-                        "Player": black_player,
-                        "Color": "Black",
-                        "ECO Code": eco_code,
-                        "Opening ": opening_name,
-                        "Date": game_date
-                    })
-                elif white_player in qualifying_players and black_player not in qualifying_players:
-                    data.append({
-                        "Player": white_player,
-                        "Color": "White",
-                        "ECO Code": eco_code,
-                        "Opening ": opening_name,
-                        "Date": game_date
-                    })
-                    
-    
+
+    for white_player, black_player, eco_code, opening_name, game_date, has_opening in zip(
+            headers.white, headers.black, headers.eco, headers.opening, headers.date, headers.hasOpening):
+
+        # Games without an Opening tag count towards qualification but aren't emitted
+        if not has_opening:
+            continue
+
+        # Only add data for eligible players
+        if white_player in qualifying_codes:
+            data.append({
+                "Player": players[white_player],
+                "Color": "White",
+                "ECO Code": eco_codes[eco_code],
+                "Opening ": openings[opening_name],
+                "Date": dates[game_date]
+            })
+        if black_player in qualifying_codes:
+            data.append({
+                "Player": players[black_player],
+                "Color": "Black",
+                "ECO Code": eco_codes[eco_code],
+                "Opening ": openings[opening_name],
+                "Date": dates[game_date]
+            })
+
     return data
 
-def create_csv(pgn_file_path, output_csv, qualifying_players):
-    game_data = extract_game_data(pgn_file_path, qualifying_players)
+def create_csv(pgn_file_path, output_csv, qualifying_players, workers=1):
+    game_data = extract_game_data(pgn_file_path, qualifying_players, workers)
     df = pd.DataFrame(game_data)
     df.to_csv(output_csv, index=False)
 
-#Process testDb
-testDB_white_games, testDB_black_games = count_games(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\testdb.pgn')
-testDB_players = filter_players(testDB_white_games, testDB_black_games, 25, 25)
-print(len(testDB_players))
-# # Process the Jan-Sept_Lumbra PGN file
-# jan_sept_white_games, jan_sept_black_games = count_games(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Jan-Sept_Lumbra.pgn')
-# jan_sept_players = filter_players(jan_sept_white_games, jan_sept_black_games, 100, 100)
-# print(len(jan_sept_players))
-# # Process the July-Sept_Lumbra PGN file for players who already qualify in Jan-Sept_Lumbra
-# july_sept_white_games, july_sept_black_games = count_games(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\July-Sept_Lumbra.pgn')
-# july_sept_players = filter_players(july_sept_white_games, july_sept_black_games, 50, 50)
-# print(len(july_sept_players))
-# # Process the Oct-Dec_Lumbra PGN file for players who already qualify in Jan-Sept_Lumbra
-# oct_dec_white_games, oct_dec_black_games = count_games(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Oct-Dec_Lumbra.pgn')
-# oct_dec_players = filter_players(oct_dec_white_games, oct_dec_black_games, 50, 50)
-# oct_dec_players = oct_dec_players.intersection(july_sept_players)  # Ensure players were also in Jan-Sept
-# print(len(oct_dec_players))
-# Create CSV files for each period
-create_csv(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\testdb.pgn', 'testDB_filtered.csv', testDB_players)
-
-# create_csv(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Jan-Sept_Lumbra.pgn', 'Jan-Sept_Lumbra_filtered.csv', jan_sept_players)
-# create_csv(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\July-Sept_Lumbra.pgn', 'July-Sept_Lumbra_filtered.csv', oct_dec_players)
-# create_csv(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Oct-Dec_Lumbra.pgn', 'Oct-Dec_Lumbra_filtered.csv', oct_dec_players)
 
+def iter_row_batches(headers, qualifying_players, batch_size=ROW_BATCH_SIZE):
+    # Same rows as extract_game_data, as batches of integer code arrays
+    # (player, color, eco, opening, date). Players are renumbered densely in order of first appearance
+    qualifying_codes = headers.player_codes(qualifying_players)
+    player_codes = {}
+    player_names = []
+    all_players = headers.players.values
+
+    def output_code(player):
+        code = player_codes.get(player)
+        if code is None:
+            code = len(player_names)
+            player_codes[player] = code
+            player_names.append(all_players[player])
+        return code
+
+    batch = [array("l"), array("b"), array("l"), array("l"), array("l")]
+    for white_player, black_player, eco_code, opening_name, game_date, has_opening in zip(
+            headers.white, headers.black, headers.eco, headers.opening, headers.date, headers.hasOpening):
+        if not has_opening:
+            continue
+        for player, color in ((white_player, 0), (black_player, 1)):
+            if player in qualifying_codes:
+                batch[0].append(output_code(player))
+                batch[1].append(color)
+                batch[2].append(eco_code)
+                batch[3].append(opening_name)
+                batch[4].append(game_date)
+
+        if len(batch[0]) >= batch_size:
+            yield batch, player_names
+            batch = [array("l"), array("b"), array("l"), array("l"), array("l")]
+
+    if len(batch[0]):
+        yield batch, player_names
+
+
+def create_columnar(pgn_file_path, output_path, qualifying_players, workers=1, batch_size=ROW_BATCH_SIZE):
+    # Dictionary-encoded alternative to create_csv, writes .parquet in row groups or a .npz of code arrays
+    headers = pgn_file_path if isinstance(pgn_file_path, GameHeaders) else scan_headers(pgn_file_path, workers)
+    dictionaries = [None, COLORS, headers.ecoCodes.values, headers.openings.values, headers.dates.values]
+    columns = ["Player", "Color", "ECO Code", "Opening ", "Date"]
+
+    if output_path.endswith(".parquet"):
+        if pa is None:
+            raise ImportError("pyarrow is required to write Parquet output")
+        writer = None
+        try:
+            for batch, player_names in iter_row_batches(headers, qualifying_players, batch_size):
+                dictionaries[0] = player_names
+                arrays = [pa.DictionaryArray.from_arrays(
+                              pa.array(np.frombuffer(codes, dtype=codes.typecode).astype(np.int32)),
+                              pa.array(values, type=pa.string()))
+                          for codes, values in zip(batch, dictionaries)]
+                table = pa.Table.from_arrays(arrays, names=columns)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    elif output_path.endswith(".npz"):
+        # The code arrays are compact, so batches are concatenated and saved once
+        codes = [array(typecode) for typecode in "lblll"]
+        player_names = []
+        for batch, player_names in iter_row_batches(headers, qualifying_players, batch_size):
+            for column, values in zip(codes, batch):
+                column.extend(values)
+        np.savez_compressed(output_path,
+                            player=np.frombuffer(codes[0], dtype=codes[0].typecode).astype(np.int32),
+                            color=np.frombuffer(codes[1], dtype=np.int8),
+                            eco=np.frombuffer(codes[2], dtype=codes[2].typecode).astype(np.int32),
+                            opening=np.frombuffer(codes[3], dtype=codes[3].typecode).astype(np.int32),
+                            date=np.frombuffer(codes[4], dtype=codes[4].typecode).astype(np.int32),
+                            player_names=np.array(player_names, dtype=str),
+                            color_names=np.array(COLORS, dtype=str),
+                            eco_names=np.array(headers.ecoCodes.values, dtype=str),
+                            opening_names=np.array(headers.openings.values, dtype=str),
+                            date_names=np.array(headers.dates.values, dtype=str))
+
+    else:
+        raise ValueError("Columnar output must be a .parquet or .npz file: " + output_path)
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS openings (
+            id INTEGER PRIMARY KEY,
+            eco_code TEXT NOT NULL,
+            opening_name TEXT NOT NULL,
+            UNIQUE (eco_code, opening_name)
+        );
+        CREATE TABLE IF NOT EXISTS games (
+            source_file TEXT NOT NULL,
+            byte_offset BIGINT NOT NULL,
+            white_id INTEGER NOT NULL REFERENCES players (id),
+            black_id INTEGER NOT NULL REFERENCES players (id),
+            opening_id INTEGER NOT NULL REFERENCES openings (id),
+            game_date TEXT NOT NULL,
+            result TEXT NOT NULL,
+            movetext TEXT NOT NULL,
+            PRIMARY KEY (source_file, byte_offset)
+        );
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            source_file TEXT PRIMARY KEY,
+            byte_offset BIGINT NOT NULL,
+            games BIGINT NOT NULL
+        );
+        """)
+
+
+def copy_rows(cursor, table, columns, rows):
+    # Bulk insert through COPY FROM STDIN, every value is quoted so empty strings aren't read as NULL
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert("COPY " + table + " (" + ", ".join(columns) + ") FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def parse_pgn_update_db(pgn_file_path, cursor, batch_size=DB_BATCH_SIZE, source_file=None):
+    # Stream the games of a PGN file into Postgres. Rows are buffered and written with COPY every
+    # batch_size games, in the same transaction as the file's checkpoint, so a crashed load resumes
+    # from the last committed batch
+    connection = cursor.connection
+    if source_file is None:
+        source_file = os.path.basename(pgn_file_path)
+
+    create_tables(cursor)
+    connection.commit()
+
+    # Players and openings already in the database, new ones get ids past the current maximum
+    cursor.execute("SELECT id, name FROM players")
+    player_ids = {name: player_id for player_id, name in cursor.fetchall()}
+    cursor.execute("SELECT id, eco_code, opening_name FROM openings")
+    opening_ids = {(eco_code, opening_name): opening_id for opening_id, eco_code, opening_name in cursor.fetchall()}
+    next_player_id = max(player_ids.values(), default=0) + 1
+    next_opening_id = max(opening_ids.values(), default=0) + 1
+
+    cursor.execute("SELECT byte_offset, games FROM ingest_checkpoints WHERE source_file = %s", (source_file,))
+    checkpoint = cursor.fetchone()
+    byte_offset, games = checkpoint if checkpoint else (0, 0)
+
+    new_players = []
+    new_openings = []
+    game_rows = []
+
+    def flush(next_offset):
+        copy_rows(cursor, "players", ("id", "name"), new_players)
+        copy_rows(cursor, "openings", ("id", "eco_code", "opening_name"), new_openings)
+        copy_rows(cursor, "games", ("source_file", "byte_offset", "white_id", "black_id", "opening_id",
+                                    "game_date", "result", "movetext"), game_rows)
+        cursor.execute("""
+            INSERT INTO ingest_checkpoints (source_file, byte_offset, games) VALUES (%s, %s, %s)
+            ON CONFLICT (source_file) DO UPDATE SET byte_offset = EXCLUDED.byte_offset, games = EXCLUDED.games
+            """, (source_file, next_offset, games))
+        connection.commit()
+        new_players.clear()
+        new_openings.clear()
+        game_rows.clear()
+
+    try:
+        end_offset = byte_offset
+        for game_offset, end_offset, tags, movetext in iter_games(pgn_file_path, byte_offset):
+            # The checkpoint is the offset of the first game that isn't committed yet
+            if len(game_rows) >= batch_size:
+                flush(game_offset)
+
+            ids = []
+            for player in (tags.get("White", ""), tags.get("Black", "")):
+                player_id = player_ids.get(player)
+                if player_id is None:
+                    player_id = player_ids[player] = next_player_id
+                    next_player_id += 1
+                    new_players.append((player_id, player))
+                ids.append(player_id)
+
+            opening = (tags.get("ECO", ""), tags.get("Opening", ""))
+            opening_id = opening_ids.get(opening)
+            if opening_id is None:
+                opening_id = opening_ids[opening] = next_opening_id
+                next_opening_id += 1
+                new_openings.append((opening_id,) + opening)
+
+            game_rows.append((source_file, game_offset, ids[0], ids[1], opening_id,
+                              tags.get("Date", ""), tags.get("Result", ""), movetext))
+            games += 1
+
+        flush(end_offset)
+    except Exception:
+        connection.rollback()
+        raise
+
+    return games
+
+
+# Guarded so the process pool workers can import this module
+if __name__ == "__main__":
+    #Process testDb, the file is scanned once and both steps read from the scan
+    testDB_headers = scan_headers(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\testdb.pgn', workers=None)
+    testDB_white_games, testDB_black_games = count_games(testDB_headers)
+    testDB_players = filter_players(testDB_white_games, testDB_black_games, 25, 25)
+    print(len(testDB_players))
+    # # Process the Jan-Sept_Lumbra PGN file
+    # jan_sept_white_games, jan_sept_black_games = count_games(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Jan-Sept_Lumbra.pgn')
+    # jan_sept_players = filter_players(jan_sept_white_games, jan_sept_black_games, 100, 100)
+    # print(len(jan_sept_players))
+    # # Process the July-Sept_Lumbra PGN file for players who already qualify in Jan-Sept_Lumbra
+    # july_sept_white_games, july_sept_black_games = count_games(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\July-Sept_Lumbra.pgn')
+    # july_sept_players = filter_players(july_sept_white_games, july_sept_black_games, 50, 50)
+    # print(len(july_sept_players))
+    # # Process the Oct-Dec_Lumbra PGN file for players who already qualify in Jan-Sept_Lumbra
+    # oct_dec_white_games, oct_dec_black_games = count_games(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Oct-Dec_Lumbra.pgn')
+    # oct_dec_players = filter_players(oct_dec_white_games, oct_dec_black_games, 50, 50)
+    # oct_dec_players = oct_dec_players.intersection(july_sept_players)  # Ensure players were also in Jan-Sept
+    # print(len(oct_dec_players))
+    # Create CSV files for each period
+    create_csv(testDB_headers, 'testDB_filtered.csv', testDB_players)
+
+    # create_csv(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Jan-Sept_Lumbra.pgn', 'Jan-Sept_Lumbra_filtered.csv', jan_sept_players)
+    # create_csv(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\July-Sept_Lumbra.pgn', 'July-Sept_Lumbra_filtered.csv', oct_dec_players)
+    # create_csv(r'C:\Users\DELL\Downloads\chess_pgns\pgn_sorted\Oct-Dec_Lumbra.pgn', 'Oct-Dec_Lumbra_filtered.csv', oct_dec_players)
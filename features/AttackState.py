@@ -0,0 +1,71 @@
+import chess_app
+
+
+class AttackState:
+    # Attack maps of a position, kept up to date as moves are pushed.
+    # attackMasks[sq] is what the piece on sq attacks, attackersTo[sq] is every piece attacking sq.
+    # A move only recomputes the pieces on the squares it changed and the sliders whose rays reach them
+    def __init__(self, board):
+        self.board = board
+        self.attackMasks = [0] * 64
+        self.attackersTo = [0] * 64
+
+        for square in chess_app.scan_reversed(board.occupied):
+            self._set_attacks(square, board.attacks_mask(square))
+
+    def copy(self, board):
+        # Same attack maps on board, a copy of this state's board
+        other = AttackState.__new__(AttackState)
+        other.board = board
+        other.attackMasks = self.attackMasks[:]
+        other.attackersTo = self.attackersTo[:]
+        return other
+
+    def _set_attacks(self, square, mask):
+        bit = chess_app.BB_SQUARES[square]
+        attackersTo = self.attackersTo
+        for target in chess_app.scan_reversed(self.attackMasks[square] ^ mask):
+            attackersTo[target] ^= bit
+        self.attackMasks[square] = mask
+
+    def push(self, move):
+        board = self.board
+        occupiedBefore = board.occupied
+        whiteBefore = board.occupied_co[chess_app.WHITE]
+
+        board.push(move)
+
+        # Squares whose occupant changed: from/to (captures and promotions keep the occupancy of to),
+        # plus the rook of a castling move and the pawn taken en passant
+        changed = (chess_app.BB_SQUARES[move.from_square] | chess_app.BB_SQUARES[move.to_square] |
+                   (occupiedBefore ^ board.occupied) | (whiteBefore ^ board.occupied_co[chess_app.WHITE]))
+
+        # A slider's ray can only open or close at a changed square it attacked before the move
+        affected = 0
+        for square in chess_app.scan_reversed(changed):
+            affected |= self.attackersTo[square]
+        affected = (affected & (board.bishops | board.rooks | board.queens)) | changed
+
+        occupied = board.occupied
+        for square in chess_app.scan_reversed(affected):
+            self._set_attacks(square, board.attacks_mask(square) if occupied & chess_app.BB_SQUARES[square] else 0)
+
+    def attacks_mask(self, square):
+        return self.attackMasks[square]
+
+    def attackers_mask(self, color, square):
+        return self.attackersTo[square] & self.board.occupied_co[color]
+
+    def attackers(self, color, square):
+        return chess_app.SquareSet(self.attackersTo[square] & self.board.occupied_co[color])
+
+    def is_attacked_by(self, color, square):
+        return bool(self.attackersTo[square] & self.board.occupied_co[color])
+
+    def attack_unions(self):
+        # Bitboard of every square attacked by each side, indexed by color
+        attackUnions = [0, 0]
+        for color in chess_app.COLORS:
+            for square in chess_app.scan_reversed(self.board.occupied_co[color]):
+                attackUnions[color] |= self.attackMasks[square]
+        return attackUnions
@@ -0,0 +1,326 @@
+import argparse
+import io
+import math
+import os
+import time
+import chess.pgn
+import numpy as np
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from MoveCodec import decode_moves, iter_move_store
+from OpeningBook import OpeningBook
+from PositionCache import PositionCache, combine_stats
+from PlayerAggregator import PlayerAggregator
+from PrefixTrie import PrefixTrie
+from Profiler import Profiler
+from ScoreCalculator import FEATURE_NAMES, NUM_FEATURES
+import chess_app.database.ParsePGN as ParsePGN
+
+# Games sent to a worker at once
+CHUNK_SIZE = 256
+
+# Chunks queued per worker before the reader waits for results
+CHUNKS_PER_WORKER = 4
+
+# Positions cached per worker, 0 disables the cache. Off by default: within a chunk PrefixTrie already shares
+# repeated prefixes, so the cache only pays off when many positions repeat across chunks
+CACHE_ENTRIES = 0
+
+# Games folded into the player aggregates between two checkpoints
+CHECKPOINT_GAMES = 100000
+
+# Seconds between throughput reports
+REPORT_INTERVAL = 30
+
+SCORE_COLUMNS = ["opening_white_activity", "opening_black_activity",
+                 "opening_white_aggression", "opening_black_aggression",
+                 "mid_white_activity", "mid_black_activity",
+                 "mid_white_aggression", "mid_black_aggression"]
+
+# Raw features of games that never reach the opening boundary
+MISSING_FEATURES = [[math.nan] * NUM_FEATURES, [math.nan] * NUM_FEATURES]
+
+# Set in each worker by init_worker, shared by every game the worker extracts
+positionCache = None
+profiler = None
+
+
+def init_worker(cache_entries, profile=False, cache_bytes=None):
+    global positionCache, profiler
+    positionCache = PositionCache(cache_entries, cache_bytes) if cache_entries else None
+    profiler = Profiler() if profile else None
+
+
+def extract_chunk(chunk):
+    # Runs in a worker: [(byte_offset, pgnText or (fen, move codes), openingLength[, (white, black, eco)])]
+    #   -> ((byte_offsets, scores, zobristHashes, openingFeatures, midFeatures), profile of the chunk or None,
+    #       PlayerAggregator of the chunk or None, (pid, PositionCache.stats() of the worker so far) or None)
+    # The results are arrays in chunk order: int64 (n,), float64 (n, SCORE_COLUMNS), uint64 (n,) and
+    # float32 (n, 2, NUM_FEATURES) twice, so the parent keeps about 300 bytes per game instead of Python lists.
+    # Games of the chunk go through one PrefixTrie so their common move prefixes are analysed once.
+    # Games from a move store are replayed from their codes without parsing SAN.
+    # Games carrying their players are folded into the chunk's PlayerAggregator
+    trie = PrefixTrie(positionCache, profiler)
+    for byte_offset, source, openingLength, *_ in chunk:
+        if isinstance(source, str):
+            trie.add(byte_offset, chess.pgn.read_game(io.StringIO(source)), openingLength)
+        else:
+            fen, codes = source
+            game = chess.pgn.Game()
+            if fen:
+                game.setup(fen)
+            trie.add(byte_offset, game, openingLength, decode_moves(codes))
+    extracted = trie.extract()
+
+    byte_offsets = np.empty(len(chunk), dtype=np.int64)
+    scores = np.empty((len(chunk), len(SCORE_COLUMNS)), dtype=np.float64)
+    hashes = np.empty(len(chunk), dtype=np.uint64)
+    openingFeatures = np.empty((len(chunk), 2, NUM_FEATURES), dtype=np.float32)
+    midFeatures = np.empty((len(chunk), 2, NUM_FEATURES), dtype=np.float32)
+    aggregator = None
+    for i, (byte_offset, _, _, *players) in enumerate(chunk):
+        (opAct, opAggro, midAct, midAggro, zobristHashOpening), gameOpening, gameMid = extracted[byte_offset]
+
+        # Games that end before the opening boundary have no opening scores
+        opening = opAct[0] + opAggro[0] if opAct else (math.nan,) * 4
+        gameScores = opening + midAct[0] + midAggro[0]
+        byte_offsets[i] = byte_offset
+        scores[i] = gameScores
+        hashes[i] = zobristHashOpening
+        openingFeatures[i] = gameOpening or MISSING_FEATURES
+        midFeatures[i] = gameMid
+
+        if players:
+            if aggregator is None:
+                aggregator = PlayerAggregator()
+            white, black, eco = players[0]
+            aggregator.add_game(white, black, eco, gameScores)
+
+    profile = None
+    if profiler is not None:
+        profile = profiler.to_dict()
+        profiler.reset()
+    cacheStats = (os.getpid(), positionCache.stats()) if positionCache is not None else None
+    return (byte_offsets, scores, hashes, openingFeatures, midFeatures), profile, aggregator, cacheStats
+
+
+def iter_chunks(pgn_file_path, openingBook, chunk_size, headerFilter=None, players=False, start=0, skip=None):
+    # Games rejected by headerFilter are skipped at the header level, their move text is never parsed.
+    # With players each game also carries (white, black, eco) for the PlayerAggregator.
+    # Reading starts at the byte offset start and games for which skip(byte_offset) is true are left out
+    chunk = []
+    for byte_offset, _, tags, movetext in ParsePGN.iter_games(pgn_file_path, start, accept=headerFilter):
+        if skip is not None and skip(byte_offset):
+            continue
+        openingLength = openingBook.game_opening_length(tags)
+        if openingLength is None:
+            continue
+        if players:
+            chunk.append((byte_offset, ParsePGN.game_text(tags, movetext), openingLength,
+                          (tags.get("White", ""), tags.get("Black", ""), tags.get("ECO", ""))))
+        else:
+            chunk.append((byte_offset, ParsePGN.game_text(tags, movetext), openingLength))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_store_chunks(store_path, chunk_size):
+    # Chunks of a move store written by MoveCodec, games are already filtered and have an opening length
+    chunk = []
+    for byte_offset, fen, codes, openingLength in iter_move_store(store_path):
+        chunk.append((byte_offset, (fen, codes), openingLength))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def extract_pgn(pgn_file_path, output_path, openingBook, workers=None, chunk_size=CHUNK_SIZE, max_in_flight=None,
+                headerFilter=None, cache_entries=CACHE_ENTRIES, profile_path=None, aggregate_path=None, cache_bytes=None,
+                resume=False):
+    # Extract the scores of every game of a PGN file (plain or compressed), see extract_chunks.
+    # With resume the aggregates continue from the checkpoint at aggregate_path and only the games it doesn't
+    # include are extracted, so output_path then holds the games of this run only
+    aggregator = None
+    start = 0
+    skip = None
+    if resume and aggregate_path is not None and os.path.exists(aggregate_path):
+        aggregator = PlayerAggregator.load(aggregate_path)
+        start = aggregator.offset
+        skip = aggregator.includes
+    return extract_chunks(iter_chunks(pgn_file_path, openingBook, chunk_size, headerFilter, aggregate_path is not None,
+                                      start, skip),
+                          output_path, workers, max_in_flight, cache_entries, profile_path, aggregate_path, cache_bytes,
+                          aggregator)
+
+
+def extract_move_store(store_path, output_path, workers=None, chunk_size=CHUNK_SIZE, max_in_flight=None,
+                       cache_entries=CACHE_ENTRIES, profile_path=None, cache_bytes=None):
+    # Same as extract_pgn for the pre-decoded games of a move store, the output is identical
+    return extract_chunks(iter_store_chunks(store_path, chunk_size), output_path,
+                          workers, max_in_flight, cache_entries, profile_path, cache_bytes=cache_bytes)
+
+
+def extract_chunks(chunks, output_path, workers=None, max_in_flight=None, cache_entries=CACHE_ENTRIES, profile_path=None,
+                   aggregate_path=None, cache_bytes=None, aggregator=None):
+    # Extract the scores of every game of chunks in a process pool and
+    # write them to a .npz keyed by the byte offset of each game (as in GameIndex), in file order.
+    # The raw opening and middlegame feature rows are stored too so Rescore can apply new weights.
+    # Each worker keeps a PositionCache of cache_entries positions (and at most cache_bytes) for openings shared
+    # between games, its hit rate is reported with the throughput and returned in the stats under "cache".
+    # With profile_path the workers' Profiler reports are merged and written there as JSON.
+    # With aggregate_path the workers' per-player aggregates are merged (into aggregator when one is given)
+    # and checkpointed there every CHECKPOINT_GAMES games, see PlayerAggregator.load. Chunks must then be runs of
+    # consecutive games in file order: the checkpoint records the byte offset before which every chunk is done
+    # and the ranges of the chunks finished past it, so an interrupted run can resume from it
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = workers * CHUNKS_PER_WORKER
+
+    # Result arrays of every chunk, concatenated once the pool is done
+    chunkResults = []
+    games = 0
+    # Latest PositionCache.stats() of each worker process, by pid
+    cacheStats = {}
+    profiler = Profiler() if profile_path else None
+    if aggregate_path and aggregator is None:
+        aggregator = PlayerAggregator()
+    checkpointAt = aggregator.games + CHECKPOINT_GAMES if aggregator is not None else None
+    # [first byte offset, last byte offset, done] of the chunks submitted past the aggregator's offset, in file order
+    progress = deque()
+    chunkProgress = {}
+
+    start = lastReport = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(cache_entries, profile_path is not None, cache_bytes)) as executor:
+        pending = set()
+
+        def collect(done):
+            nonlocal checkpointAt, games
+            for future in done:
+                results, profile, chunkAggregator, workerCache = future.result()
+                if workerCache is not None:
+                    pid, cacheStats[pid] = workerCache
+                if profile is not None:
+                    profiler.merge(profile)
+                if aggregator is not None:
+                    if chunkAggregator is not None:
+                        aggregator.merge(chunkAggregator)
+                    # The offset moves past the chunks finished in file order, later finished chunks are ranges
+                    chunkProgress.pop(future)[2] = True
+                    while progress and progress[0][2]:
+                        aggregator.offset = progress.popleft()[1] + 1
+                    if progress:
+                        aggregator.offset = progress[0][0]
+                    aggregator.ranges = [(first, last) for first, last, done in progress if done]
+                    if aggregator.games >= checkpointAt:
+                        aggregator.checkpoint(aggregate_path)
+                        checkpointAt += CHECKPOINT_GAMES
+                chunkResults.append(results)
+                games += len(results[0])
+
+        for chunk in chunks:
+            # Bound the work in flight so the reader can't run ahead of the workers
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(extract_chunk, chunk)
+            pending.add(future)
+            if aggregator is not None:
+                chunkProgress[future] = [chunk[0][0], chunk[-1][0], False]
+                progress.append(chunkProgress[future])
+
+            now = time.perf_counter()
+            if now - lastReport >= REPORT_INTERVAL:
+                lastReport = now
+                cacheReport = f", cache hit rate {combine_stats(cacheStats.values())['hitRate']:.1%}" if cacheStats else ""
+                print(f"{games} games, {games / (now - start):.1f} games/s{cacheReport}")
+
+        done, _ = wait(pending)
+        collect(done)
+
+    elapsed = time.perf_counter() - start
+    stats = {"games": games, "seconds": elapsed, "gamesPerSecond": games / elapsed if elapsed else 0.0}
+    print(f"{stats['games']} games in {elapsed:.1f}s, {stats['gamesPerSecond']:.1f} games/s")
+    if cacheStats:
+        stats["cache"] = combine_stats(cacheStats.values())
+        print("Position cache", stats["cache"])
+
+    if profiler is not None:
+        profiler.export_json(profile_path)
+    if aggregator is not None:
+        aggregator.checkpoint(aggregate_path)
+
+    # Chunks finish out of order. Each chunk is a run of consecutive games in file order, so sorting the
+    # chunks by their first byte offset puts the rows back into file order
+    chunkResults.sort(key=lambda results: results[0][0])
+    empty = (np.empty(0, dtype=np.int64), np.empty((0, len(SCORE_COLUMNS))), np.empty(0, dtype=np.uint64),
+             np.empty((0, 2, NUM_FEATURES), dtype=np.float32), np.empty((0, 2, NUM_FEATURES), dtype=np.float32))
+    byte_offsets, scores, hashes, openingFeatures, midFeatures = (
+        np.concatenate([column] + [results[i] for results in chunkResults]) for i, column in enumerate(empty))
+    chunkResults.clear()
+    columns = {name: scores[:, i] for i, name in enumerate(SCORE_COLUMNS)}
+    np.savez_compressed(output_path,
+                        byte_offset=byte_offsets,
+                        opening_hash=hashes,
+                        opening_features=openingFeatures,
+                        mid_features=midFeatures,
+                        feature_names=np.array(FEATURE_NAMES),
+                        **columns)
+
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract playstyle scores for every game of a PGN file")
+    parser.add_argument("pgn", help="PGN file, .zst/.bz2/.gz dumps are read as a stream")
+    parser.add_argument("--move-store", action="store_true", help="pgn is a move store written by MoveCodec, its moves are replayed without parsing SAN")
+    parser.add_argument("output", help="Output .npz file")
+    parser.add_argument("--opening-book", help="CSV snapshot of the opening_book table, the database is used if omitted")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--cache-entries", type=int, default=CACHE_ENTRIES, help="Positions cached per worker, 0 (the default) disables it")
+    parser.add_argument("--cache-bytes", type=int, default=None, help="Approximate memory cap of each worker's position cache")
+    parser.add_argument("--profile", help="Write call counts and timings of the extraction hot path to this JSON file")
+    parser.add_argument("--aggregate", help="Checkpoint file of the per-(player, color, ECO) score statistics, PGN input only")
+    parser.add_argument("--resume", action="store_true", help="Continue the --aggregate checkpoint, only the games it doesn't include are extracted")
+    parser.add_argument("--players", help="File with one qualifying player per line, other games are skipped")
+    parser.add_argument("--eco", help="Comma separated ECO codes to keep")
+    parser.add_argument("--date-from", help="First game date to keep, YYYY.MM.DD")
+    parser.add_argument("--date-to", help="Last game date to keep, YYYY.MM.DD")
+    args = parser.parse_args()
+
+    headerFilter = None
+    if args.players or args.eco or args.date_from or args.date_to:
+        players = None
+        if args.players:
+            with open(args.players, encoding="utf-8") as playersFile:
+                players = {line.strip() for line in playersFile if line.strip()}
+        headerFilter = ParsePGN.HeaderFilter(players, set(args.eco.split(",")) if args.eco else None,
+                                             args.date_from, args.date_to)
+
+    if args.move_store and (args.aggregate or args.resume):
+        parser.error("--aggregate and --resume need PGN input, a move store doesn't keep the players")
+    if args.resume and not args.aggregate:
+        parser.error("--resume continues the --aggregate checkpoint")
+
+    if args.move_store:
+        extract_move_store(args.pgn, args.output, args.workers, args.chunk_size,
+                           cache_entries=args.cache_entries, profile_path=args.profile, cache_bytes=args.cache_bytes)
+    else:
+        if args.opening_book:
+            openingBook = OpeningBook().load_snapshot(args.opening_book)
+        else:
+            import psycopg2
+            connection = psycopg2.connect('')
+            openingBook = OpeningBook(connection.cursor()).load()
+
+        extract_pgn(args.pgn, args.output, openingBook, args.workers, args.chunk_size, headerFilter=headerFilter,
+                    cache_entries=args.cache_entries, profile_path=args.profile, aggregate_path=args.aggregate,
+                    cache_bytes=args.cache_bytes, resume=args.resume)
+        print(openingBook.stats())
@@ -1,168 +1,257 @@
 import chess_app
 import chess.pgn
 import chess.polyglot
+from collections import deque
+from AttackState import AttackState
 from Utilities import Utilities
-from ScoreCalculator import ScoreCalculator
+from ScoreCalculator import (ScoreCalculator, FEATURE_NAMES, NUM_FEATURES, PAWN_BREAKS, ATTACKS, INFILTRATIONS,
+                             KING_ATTACKS, XRAY_ATTACKS, PAWN_STORMS, RETREATS, PATIENT_MOVES, PIECE_MOVES,
+                             ACTIVE_DEFENSE, CENTRAL_CONTROL, SPACE_ADVANTAGE, PIECES_AT_HOME, CASTLE_TURN)
+
+# Squares scored by central control, central squares are worth 2 and supporting squares 1
+CENTRAL_SQUARES = chess_app.BB_D4 | chess_app.BB_E4 | chess_app.BB_D5 | chess_app.BB_E5
+SUPPORTING_SQUARES = (chess_app.BB_C3 | chess_app.BB_C4 | chess_app.BB_C5 | chess_app.BB_C6 |
+                      chess_app.BB_F3 | chess_app.BB_F4 | chess_app.BB_F5 | chess_app.BB_F6)
+
+# Space advantage weights per rank of the opponent's half, deeper ranks are worth more
+WHITE_SPACE_RANKS = [(chess_app.BB_RANK_5, 1), (chess_app.BB_RANK_6, 2), (chess_app.BB_RANK_7, 3), (chess_app.BB_RANK_8, 4)]
+BLACK_SPACE_RANKS = [(chess_app.BB_RANK_4, 1), (chess_app.BB_RANK_3, 2), (chess_app.BB_RANK_2, 3), (chess_app.BB_RANK_1, 4)]
 
 class FeatureExtractor:
-    def __init__(self, game, openingLength):
+    def __init__(self, game, openingLength, positionCache=None, profiler=None, debug=False):
         self.game = game
         self.board = game.board()
+        # Attack maps shared by every counter, updated incrementally as moves are pushed
+        self.attackState = AttackState(self.board)
         self.openingLength = openingLength
         self.openingLengthFull = openingLength/2 # Fullmove count, not single move
-        self.features = {
-            # Used for Both Scores
-            "whitePawnBreaks": 0,
-            "blackPawnBreaks": 0,
-            "whiteAttacks": 0,
-            "blackAttacks": 0,
-
-            
-            # Used for Aggro Score
-            "whiteInfiltrations": 0,
-            "blackInfiltrations": 0,
-            "whiteKingAttacks": 0,
-            "blackKingAttacks": 0,
-            "whiteXrayAttacks": 0,
-            "blackXrayAttacks": 0,
-            "whitePawnStorms": 0,
-            "blackPawnStorms": 0,
-            # Aggro Penalties
-            "whiteRetreats": 0,
-            "blackRetreats": 0,
-            "whitePatientMoves": 0,
-            "blackPatientMoves": 0,
-            
-            # Used for Activity Score
-            "whitePieceMoves": 0,
-            "blackPieceMoves": 0,
-            "whiteActiveDefense": 0,
-            "blackActiveDefense": 0,
-            "whiteCentralControl": 0,
-            "blackCentralControl": 0,
-            "whiteSpaceAdvantage": 0,
-            "blackSpaceAdvantage": 0,
-            "whitePiecesAtHome": 0,
-            "blackPiecesAtHome": 0,
-            
-
-            # Usefulness determines preference for early castling
-            "whiteCastleTurn": 0,
-            "blackCastleTurn": 0,
-
-        }
+        # Last 6 half-moves as (move, movingPiece, fromSq, toSq), recorded when played so pawn storms don't replay the board
+        self.recentMoves = deque(maxlen=6)
+        # Per-color feature rows indexed by color (BLACK = 0, WHITE = 1), layout in ScoreCalculator.FEATURE_NAMES
+        self.features = [[0] * NUM_FEATURES, [0] * NUM_FEATURES]
+        # Raw feature rows behind the opening and middlegame scores, kept so games can be rescored without replaying them
+        self.openingFeatures = None
+        self.midFeatures = None
+        # Optional PositionCache shared across games, keyed by the board's transposition key (piece bitboards,
+        # side to move, castling rights and en passant square), which is exact and far cheaper than a Zobrist hash
+        self.positionCache = positionCache
+        self.positionKey = None
+        # Optional Profiler timing the counters and board operations, None keeps the hot path untouched
+        self.profiler = profiler
+        # Print the board at the opening boundary
+        self.debug = debug
+        # Pre-decoded mainline set by from_moves, replayed instead of parsing the game's SAN
+        self.moves = None
+        if profiler is not None:
+            profiler.instrument(self)
 
         
     def extract_features(self):
-        openingActivityScores = []
-        openingAggressionScores = []
-        
-        midActivityScores = []
-        midAggressionScores = []
-        
-        num = 0
-        zobristHashOpening = 0
-        
-        for move in self.game.mainline_moves():
-            if Utilities.is_endgame(self.board):
+        self._start()
+        for move in self.game.mainline_moves() if self.moves is None else self.moves:
+            if not self._step(move):
                 break
-            halfMoveCt = len(self.board.move_stack)
-            fromSq = move.from_square
-            toSq = move.to_square
-            movingPiece = self.board.piece_at(fromSq)
-            attackedBefore = self.board.attacks(fromSq)
-
-            isRetreat = Utilities.is_retreating_from_attack(self.board, fromSq, toSq, movingPiece)
-            isCheck = self.board.gives_check(move)
-            isCastling = self.board.is_castling(move)
-            isCapture = self.board.is_capture(move)
-            
-            # Flag for PatientMoves, if a move attacks something or actively defends something -> it isn't patient
-            isActiveMove = False
-            
-            # Flag for Attacks, if a pawnbreak occurs -> it shouldn't be double counted as an attack
-            isPawnBreak = False
-            
-            # Only required for methods that measure capture outcome
-            targetPiece = self.board.piece_at(toSq) if isCapture else None
-            defendedSq = chess_app.SquareSet(self.board.attacks(toSq)) if isCapture else None
-                
-            # Flag to count retreats and not double count a retreat as a patient move b/c retreats are forced
-            if isRetreat:
-                self._increment_feature("whiteRetreats" if movingPiece.color == chess_app.WHITE else "blackRetreats")
+        return self._finish()
+
+    @classmethod
+    def from_moves(cls, moves, openingLength, fen=None, positionCache=None, profiler=None, debug=False):
+        # Trusted replay of a pre-validated mainline (e.g. MoveCodec.decode_moves of a move store).
+        # No SAN is parsed and board.push applies the moves as given, without checking legality
+        game = chess.pgn.Game()
+        if fen:
+            game.setup(fen)
+        extractor = cls(game, openingLength, positionCache, profiler, debug)
+        extractor.moves = moves
+        return extractor
+
+    # extract_features is split in _start, one _step per move and _finish so PrefixTrie can share
+    # the work on a common move prefix between games and clone() the state where they diverge
+    def _start(self):
+        self.openingActivityScores = []
+        self.openingAggressionScores = []
+        self.midSamples = 0
+        self.zobristHashOpening = 0
+        # Set once the endgame is reached, later moves are ignored
+        self.stopped = False
+
+        if self.positionCache is not None:
+            self.positionKey = self.board._transposition_key()
+
+    def _step(self, move):
+        if self.stopped or Utilities.is_endgame(self.board):
+            self.stopped = True
+            return False
+        halfMoveCt = len(self.board.move_stack)
+        if self.profiler is not None:
+            self.profiler.count_ply("opening" if halfMoveCt <= self.openingLength else "middlegame")
+        fromSq = move.from_square
+        toSq = move.to_square
+        movingPiece = self.board.piece_at(fromSq)
+
+        if self.board.is_castling(move):
+            self.features[movingPiece.color][CASTLE_TURN] = self.board.fullmove_number
+
+        if self.positionCache is None:
+            self._count_move(move, fromSq, toSq, movingPiece)
+        else:
+            self._count_move_cached(move, fromSq, toSq, movingPiece)
+        self.recentMoves.append((move, movingPiece, fromSq, toSq))
+        
+        # Sliding Window for central control and space advantage
+        if halfMoveCt == self.openingLength:
             
-            if isCastling:
-                if movingPiece.color == chess_app.WHITE:
-                    self.features["whiteCastleTurn"] = self.board.fullmove_number
-                else:
-                    self.features["blackCastleTurn"] = self.board.fullmove_number
-            
-            self.board.push(move)
-                        
-            # Get attacked squares after the move is pushed            
-            attackedSq = self.board.attacks(toSq)
+            self._calculate_control()
             
+            self._count_pieces_at_home(self.board)
 
-            # Count features of the move and update flag values accordingly
-            isPawnBreak = self._count_pawn_breaks(self.board, movingPiece, attackedSq, isPawnBreak)
-            isActiveMove = self._count_unique_attacks(self.board, movingPiece, attackedBefore, attackedSq, isPawnBreak, isActiveMove)
-            self._count_infiltrations(movingPiece, toSq, fromSq)
-            self._count_king_attacks(movingPiece, isCheck, targetPiece, defendedSq, attackedSq)
-            self._count_xray_attacks(self.board, toSq, movingPiece.color, movingPiece)
-            self._count_piece_movement(movingPiece)
-            isActiveMove = self._count_active_defends(self.board, movingPiece, attackedSq, attackedBefore, isActiveMove)
-            self._count_patient_moves(isCapture, movingPiece, isActiveMove, isRetreat)
+            self.openingFeatures = [row[:] for row in self.features]
+            calc = ScoreCalculator(self.features)
             
-            # Sliding Window for central control and space advantage
-            if halfMoveCt == self.openingLength:
-                
-                self._calculate_central_control(self.board)
-                self._calculate_space_advantage(self.board)
-                
-                self._count_pieces_at_home(self.board)
-
-                calc = ScoreCalculator(self.features)
-                
-                openingActivityScores.append(calc.activity_score())
-                openingAggressionScores.append(calc.aggression_score())
-                
-                zobristHashOpening = chess_app.polyglot.zobrist_hash(self.board)
+            self.openingActivityScores.append(calc.activity_score())
+            self.openingAggressionScores.append(calc.aggression_score())
+            
+            self.zobristHashOpening = chess_app.polyglot.zobrist_hash(self.board)
+            if self.debug:
                 print(self.board)
 
-                self._reset_features_for_mid()
-            
-            elif halfMoveCt > self.openingLength:
-            # Sliding window to calculate average central control every 2 full moves after opening
-                if halfMoveCt % 4 == 0:
-                    num+=1
-                    self._calculate_central_control(self.board)
-                    self._calculate_space_advantage(self.board)
-            
-                # Sliding window to detect pawn storms every 3 full moves
-                if halfMoveCt >= self.openingLength + 6 or (6 < halfMoveCt < self.openingLength):
-                    prevMoves = Utilities.get_prev_n_moves(self.board, 6)
-                    if movingPiece.color == chess_app.WHITE and self._detect_pawn_storm(self.board, movingPiece.color, prevMoves):
-                        self._increment_feature("whitePawnStorms")
-                    elif movingPiece.color == chess_app.BLACK and self._detect_pawn_storm(self.board, movingPiece.color, prevMoves):
-                        self._increment_feature("blackPawnStorms")
+            self._reset_features_for_mid()
+        
+        elif halfMoveCt > self.openingLength:
+        # Sliding window to calculate average central control every 2 full moves after opening
+            if halfMoveCt % 4 == 0:
+                self.midSamples += 1
+                self._calculate_control()
         
-        self._avg_feature("whiteCentralControl", num)
-        self._avg_feature("blackCentralControl", num)
-        self._avg_feature("whiteSpaceAdvantage", num)
-        self._avg_feature("blackSpaceAdvantage", num)
+            # Sliding window to detect pawn storms every 3 full moves
+            if halfMoveCt >= self.openingLength + 6 or (6 < halfMoveCt < self.openingLength):
+                if movingPiece.color == chess_app.WHITE and self._detect_pawn_storm(movingPiece.color, self.recentMoves):
+                    self._increment_feature(chess_app.WHITE, PAWN_STORMS)
+                elif movingPiece.color == chess_app.BLACK and self._detect_pawn_storm(movingPiece.color, self.recentMoves):
+                    self._increment_feature(chess_app.BLACK, PAWN_STORMS)
+        return True
+
+    def _finish(self):
+        if self.profiler is not None:
+            self.profiler.count_game()
+        self._avg_feature(CENTRAL_CONTROL, self.midSamples)
+        self._avg_feature(SPACE_ADVANTAGE, self.midSamples)
         
+        self.midFeatures = [row[:] for row in self.features]
         calc = ScoreCalculator(self.features)
-        midActivityScores.append(calc.activity_score())
-        midAggressionScores.append(calc.aggression_score())
+        midActivityScores = [calc.activity_score()]
+        midAggressionScores = [calc.aggression_score()]
+        
+        return (self.openingActivityScores, self.openingAggressionScores, midActivityScores, midAggressionScores,
+                self.zobristHashOpening)
+
+    def clone(self):
+        # Independent copy of the state between two _step calls, the game and the position cache are shared
+        other = FeatureExtractor.__new__(FeatureExtractor)
+        other.__dict__.update(self.__dict__)
+        other.board = self.board.copy()
+        other.attackState = self.attackState.copy(other.board)
+        other.recentMoves = self.recentMoves.copy()
+        other.features = [row[:] for row in self.features]
+        other.openingActivityScores = self.openingActivityScores[:]
+        other.openingAggressionScores = self.openingAggressionScores[:]
+        if self.profiler is not None:
+            self.profiler.instrument(other)
+        return other
+    
+    # Per-move counters, pushes the move
+    def _count_move(self, move, fromSq, toSq, movingPiece):
+        attackedBefore = self.attackState.attacks_mask(fromSq)
+
+        isRetreat = Utilities.is_retreating_from_attack(self.board, fromSq, toSq, movingPiece, self.attackState)
+        isCheck = self.board.gives_check(move)
+        isCapture = self.board.is_capture(move)
+        
+        # Flag for PatientMoves, if a move attacks something or actively defends something -> it isn't patient
+        isActiveMove = False
+        
+        # Flag for Attacks, if a pawnbreak occurs -> it shouldn't be double counted as an attack
+        isPawnBreak = False
+        
+        # Only required for methods that measure capture outcome
+        targetPiece = self.board.piece_at(toSq) if isCapture else None
+        defendedSq = chess_app.SquareSet(self.attackState.attacks_mask(toSq)) if isCapture else None
+            
+        # Flag to count retreats and not double count a retreat as a patient move b/c retreats are forced
+        if isRetreat:
+            self._increment_feature(movingPiece.color, RETREATS)
+        
+        self.attackState.push(move)
+                    
+        # Get attacked squares after the move is pushed            
+        attackedSq = chess_app.SquareSet(self.attackState.attacks_mask(toSq))
         
-        return openingActivityScores, openingAggressionScores, midActivityScores, midAggressionScores, zobristHashOpening
+
+        # Count features of the move and update flag values accordingly
+        isPawnBreak = self._count_pawn_breaks(self.board, movingPiece, attackedSq, isPawnBreak)
+        isActiveMove = self._count_unique_attacks(self.board, movingPiece, attackedBefore, attackedSq, isPawnBreak, isActiveMove)
+        self._count_infiltrations(movingPiece, toSq, fromSq)
+        self._count_king_attacks(movingPiece, isCheck, targetPiece, defendedSq, attackedSq)
+        self._count_xray_attacks(self.board, toSq, movingPiece.color, movingPiece)
+        self._count_piece_movement(movingPiece)
+        isActiveMove = self._count_active_defends(self.board, movingPiece, attackedSq, attackedBefore, isActiveMove)
+        self._count_patient_moves(isCapture, movingPiece, isActiveMove, isRetreat)
+
+    # Same as _count_move, but the feature changes of a (position, move) pair are looked up in the cache
+    def _count_move_cached(self, move, fromSq, toSq, movingPiece):
+        key = ("move", self.positionKey, move)
+        delta = self.positionCache.get(key)
+        row = self.features[movingPiece.color]
+
+        if delta is None:
+            before = row[:]
+            self._count_move(move, fromSq, toSq, movingPiece)
+            # Every counter only changes the moving side's row
+            delta = tuple((feature, row[feature] - before[feature]) for feature in range(NUM_FEATURES) if row[feature] != before[feature])
+            self.positionCache.put(key, delta)
+        else:
+            self.attackState.push(move)
+            for feature, amount in delta:
+                row[feature] += amount
+
+        self.positionKey = self.board._transposition_key()
+
+    # Central control and space advantage of the current position, cached by position key when a cache is shared
+    def _calculate_control(self):
+        if self.positionCache is not None:
+            key = ("control", self.positionKey)
+            control = self.positionCache.get(key)
+            if control is not None:
+                for row, (central, space) in zip(self.features, control):
+                    row[CENTRAL_CONTROL] += central
+                    row[SPACE_ADVANTAGE] += space
+                return
+            before = [(row[CENTRAL_CONTROL], row[SPACE_ADVANTAGE]) for row in self.features]
+
+        attackUnions = self.attackState.attack_unions()
+        self._calculate_central_control(attackUnions)
+        self._calculate_space_advantage(attackUnions)
+
+        if self.positionCache is not None:
+            self.positionCache.put(key, tuple((row[CENTRAL_CONTROL] - central, row[SPACE_ADVANTAGE] - space)
+                                              for row, (central, space) in zip(self.features, before)))
     
     
-    def _increment_feature(self, featureName, amount=1):
-        self.features[featureName] += amount
+    def features_dict(self):
+        # Named view of the feature rows, e.g. {"whitePawnBreaks": 2, "blackPawnBreaks": 1, ...}
+        features = {}
+        for index, name in enumerate(FEATURE_NAMES):
+            features["white" + name] = self.features[chess_app.WHITE][index]
+            features["black" + name] = self.features[chess_app.BLACK][index]
+        return features
+
+    def _increment_feature(self, color, feature, amount=1):
+        self.features[color][feature] += amount
     
-    def _avg_feature(self, featureName, amount):
-        self.features[featureName] /= amount
+    def _avg_feature(self, feature, amount):
+        # Games that end before the first middlegame sample have nothing to average
+        if amount:
+            for row in self.features:
+                row[feature] /= amount
         
     def _count_pawn_breaks(self, board, movingPiece, attackedSq, isPawnBreak):
 
@@ -174,7 +263,7 @@ class FeatureExtractor:
                 targetPiece = board.piece_at(square)
 
                 if targetPiece and targetPiece.piece_type == chess_app.PAWN and targetPiece.color != movingPiece.color:
-                    self._increment_feature("whitePawnBreaks" if movingPiece.color == chess_app.WHITE else "blackPawnBreaks")
+                    self._increment_feature(movingPiece.color, PAWN_BREAKS)
                     isPawnBreak = True
         
         return isPawnBreak
@@ -194,7 +283,7 @@ class FeatureExtractor:
             if board.piece_at(square) and board.color_at(square) != movingPiece.color:
                     #check if piece was not already attacked before move
                     if not (attackedBefore & chess_app.BB_SQUARES[square]): 
-                        self._increment_feature("whiteAttacks" if movingPiece.color == chess_app.WHITE else "blackAttacks")
+                        self._increment_feature(movingPiece.color, ATTACKS)
                         isActiveMove = True
                         return isActiveMove
     
@@ -203,9 +292,9 @@ class FeatureExtractor:
     # Count number of times a piece or pawn is pushed to the opp side of the board
     def _count_infiltrations(self, movingPiece, toSq, fromSq):
         if movingPiece.color == chess_app.WHITE and toSq > 31 and fromSq < 32:
-            self._increment_feature("whiteInfiltrations")
+            self._increment_feature(chess_app.WHITE, INFILTRATIONS)
         elif movingPiece.color == chess_app.BLACK and toSq < 32 and fromSq > 31:
-            self._increment_feature("blackInfiltrations")
+            self._increment_feature(chess_app.BLACK, INFILTRATIONS)
             
             
     # Count king attacks, 
@@ -224,15 +313,15 @@ class FeatureExtractor:
         # Determine if the king is an attacked sq, or if king adj sq is an attacked sq
         if movingPiece.color == chess_app.WHITE:
             if blackKingSq in attackedSq or not blackKingAdjSq.isdisjoint(attackedSq):
-                self._increment_feature("whiteKingAttacks", 2 if isCheck else 1)
+                self._increment_feature(chess_app.WHITE, KING_ATTACKS, 2 if isCheck else 1)
                 # Award bonus point if defending piece was taken
                 if targetPiece and targetPiece.color == chess_app.BLACK and not blackKingAdjSq.isdisjoint(defendedSq):
-                    self._increment_feature("whiteKingAttacks", 2)
+                    self._increment_feature(chess_app.WHITE, KING_ATTACKS, 2)
         elif movingPiece.color == chess_app.BLACK:
             if whiteKingSq in attackedSq or not whiteKingAdjSq.isdisjoint(attackedSq):
-                self._increment_feature("blackKingAttacks", 2 if isCheck else 1)
+                self._increment_feature(chess_app.BLACK, KING_ATTACKS, 2 if isCheck else 1)
                 if targetPiece and targetPiece.color == chess_app.BLACK and not whiteKingAdjSq.isdisjoint(defendedSq):
-                    self._increment_feature("blackKingAttacks", 3)
+                    self._increment_feature(chess_app.BLACK, KING_ATTACKS, 3)
 
 
     def _count_xray_attacks(self, board, toSq, color, movingPiece):
@@ -305,19 +394,19 @@ class FeatureExtractor:
                 )
 
             if len(xray_attacked_squares) > 0:
-                self._increment_feature("whiteXrayAttacks" if movingPiece.color == chess_app.WHITE else "blackXrayAttacks", 1)
+                self._increment_feature(movingPiece.color, XRAY_ATTACKS)
 
 
     # Counter for moves that are not active, not captures, and not retreats                   
     def _count_patient_moves(self, isCapture, movingPiece, isActiveMove, isRetreat):
         if not isActiveMove and not isCapture and not isRetreat:
-            self._increment_feature("whitePatientMoves" if movingPiece.color == chess_app.WHITE else "blackPatientMoves")
+            self._increment_feature(movingPiece.color, PATIENT_MOVES)
 
 
     # If a piece is moved, increment    
     def _count_piece_movement(self, movingPiece):
         if movingPiece.piece_type not in [chess_app.PAWN, chess_app.KING]:
-            self._increment_feature("whitePieceMoves" if movingPiece.color == chess_app.WHITE else "blackPieceMoves")
+            self._increment_feature(movingPiece.color, PIECE_MOVES)
     
     
     # Increment if pieces are defended by a move
@@ -329,8 +418,8 @@ class FeatureExtractor:
             # Exclude Kings, ensure that piece is same color
             if defendedPiece and defendedPiece.piece_type != chess_app.KING and board.color_at(square) == movingPiece.color:
                 # Check if piece was not already attacked and check that piece is currently being attacked
-                if not (attackedBefore & chess_app.BB_SQUARES[square]) and board.is_attacked_by(not movingPiece.color, square):
-                    self._increment_feature("whiteActiveDefense" if movingPiece.color == chess_app.WHITE else "blackActiveDefense")
+                if not (attackedBefore & chess_app.BB_SQUARES[square]) and self.attackState.is_attacked_by(not movingPiece.color, square):
+                    self._increment_feature(movingPiece.color, ACTIVE_DEFENSE)
                     # Flag for determining patient moves
                     isActiveMove = True
     
@@ -361,54 +450,31 @@ class FeatureExtractor:
         for square, piece in board.piece_map().items():
             if piece.color == chess_app.WHITE:
                 if square in whiteHomeSq and piece.piece_type == whiteHomeSq[square]:
-                    self._increment_feature("whitePiecesAtHome")
+                    self._increment_feature(chess_app.WHITE, PIECES_AT_HOME)
             elif piece.color == chess_app.BLACK:
                 if square in blackHomeSq and piece.piece_type == blackHomeSq[square]:
-                    self._increment_feature("blackPiecesAtHome")
-
-
-    def _calculate_central_control(self, board):
-        central_squares = [chess_app.D4, chess_app.E4, chess_app.D5, chess_app.E5]
-        supporting_squares = [chess_app.C3, chess_app.C4, chess_app.C5, chess_app.C6, 
-                              chess_app.F3, chess_app.F4, chess_app.F5, chess_app.F6]
- 
-        for square in central_squares:
-            attackers_white = board.attackers(chess_app.WHITE, square)
-            attackers_black = board.attackers(chess_app.BLACK, square)
+                    self._increment_feature(chess_app.BLACK, PIECES_AT_HOME)
 
-            # Value for central squares is greater than supporting squares
-            if attackers_white:
-                self._increment_feature("whiteCentralControl", 2)
-            if attackers_black:
-                self._increment_feature("blackCentralControl", 2)
 
-        for square in supporting_squares:
-            attackers_white = board.attackers(chess_app.WHITE, square)
-            attackers_black = board.attackers(chess_app.BLACK, square)
+    def _calculate_central_control(self, attackUnions):
+        # Value for central squares is greater than supporting squares
+        for color in (chess_app.WHITE, chess_app.BLACK):
+            self._increment_feature(color, CENTRAL_CONTROL,
+                                    2 * chess_app.popcount(attackUnions[color] & CENTRAL_SQUARES) +
+                                    chess_app.popcount(attackUnions[color] & SUPPORTING_SQUARES))
 
-            if attackers_white:
-                self._increment_feature("whiteCentralControl", 1)
-            if attackers_black:
-                self._increment_feature("blackCentralControl", 1)
 
 
-
-    def _calculate_space_advantage(self, board):
-        for square in chess_app.SQUARES:
-            rank = chess_app.square_rank(square)
-            attackers_white = board.attackers(chess_app.WHITE, square)
-            attackers_black = board.attackers(chess_app.BLACK, square)
-
-            if attackers_white and rank >= 4:  # White controls squares in opponent's territory
-                self._increment_feature("whiteSpaceAdvantage", (rank - 3))
-
-            if attackers_black and rank <= 3:  # Black controls squares in opponent's territory
-                self._increment_feature("blackSpaceAdvantage", (4 - rank))
+    def _calculate_space_advantage(self, attackUnions):
+        # Squares controlled in the opponent's territory, weighted by how deep they are
+        for color, spaceRanks in ((chess_app.WHITE, WHITE_SPACE_RANKS), (chess_app.BLACK, BLACK_SPACE_RANKS)):
+            self._increment_feature(color, SPACE_ADVANTAGE, sum(weight * chess_app.popcount(attackUnions[color] & rank)
+                                                                for rank, weight in spaceRanks))
 
 
 
     # Iterate through previous moves to check if multiple pawns have been pushed toward opp king
-    def _detect_pawn_storm(self, board, color, prevMoves) -> bool:
+    def _detect_pawn_storm(self, color, recentMoves) -> bool:
 
         kingside_files = [5, 6, 7]
         queenside_files = [0, 1, 2]
@@ -417,22 +483,25 @@ class FeatureExtractor:
         kingside_advances = 0
         queenside_advances = 0
         
-        for move in prevMoves:
-            movingPiece = board.piece_at(move.from_square)
+        # Pawns advance up the board for white and down for black
+        direction = 1 if color == chess_app.WHITE else -1
+
+        # The piece is the one recorded when the move was played, its from square is empty by now
+        for move, movingPiece, fromSq, toSq in recentMoves:
             
             if movingPiece and movingPiece.piece_type == chess_app.PAWN and movingPiece.color == color:
                 
-                from_file = chess_app.square_file(move.from_square)
-                to_file = chess_app.square_file(move.to_square)
+                from_file = chess_app.square_file(fromSq)
+                to_file = chess_app.square_file(toSq)
                 
                 # Check for kingside pawn storm
                 if from_file in kingside_files and to_file in kingside_files:
-                    if chess_app.square_rank(move.to_square) > chess_app.square_rank(move.from_square):  # Pawn advanced
+                    if (chess_app.square_rank(toSq) - chess_app.square_rank(fromSq)) * direction > 0:  # Pawn advanced
                         kingside_advances += 1
                 
                 # Check for queenside pawn storm
                 elif from_file in queenside_files and to_file in queenside_files:
-                    if chess_app.square_rank(move.to_square) > chess_app.square_rank(move.from_square):  # Pawn advanced
+                    if (chess_app.square_rank(toSq) - chess_app.square_rank(fromSq)) * direction > 0:  # Pawn advanced
                         queenside_advances += 1
                 
         if kingside_advances >= 2 or queenside_advances >= 2:
@@ -442,19 +511,8 @@ class FeatureExtractor:
     
     # After the opening, values are reset to zero for the mid game values
     def _reset_features_for_mid(self):
-        reset_keys = ["whitePawnBreaks", "blackPawnBreaks",
-                      "whitePieceMoves", "blackPieceMoves",
-                      "whiteAttacks", "blackAttacks",
-                      "whiteInfiltrations", "blackInfiltrations",
-                      "whiteKingAttacks", "blackKingAttacks",
-                      "whiteActiveDefense", "blackActiveDefense",
-                      "whiteXrayAttacks", "blackXrayAttacks",
-                      "whiteRetreats", "blackRetreats",
-                      "whitePatientMoves", "blackPatientMoves",
-                      "whitePiecesAtHome", "blackPiecesAtHome",
-                      "whiteCentralControl", "blackCentralControl",
-                      "whiteSpaceAdvantage", "blackSpaceAdvantage",
-                      "whitePawnStorms", "blackPawnStorms"]
-        
-        for key in reset_keys:
-            self.features[key] = 0
+        # Castle turns are kept for the whole game
+        for row in self.features:
+            for feature in range(NUM_FEATURES):
+                if feature != CASTLE_TURN:
+                    row[feature] = 0
@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from BatchExtract import CACHE_ENTRIES, SCORE_COLUMNS, extract_chunk, init_worker
+from OpeningBook import OpeningBook
+
+# aiohttp is only needed to download games from Lichess
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+LICHESS_URL = "https://lichess.org"
+
+# Connections kept open to the API and shared by every request of a fetcher
+CONNECTION_LIMIT = 4
+
+# Games being extracted at once, the download waits for results beyond that
+MAX_IN_FLIGHT = 32
+
+# Lichess asks clients to wait a full minute after a 429, doubled on every retry
+RATE_LIMIT_WAIT = 60
+MAX_RETRIES = 5
+
+# Profile entries, averaged over the games of the player's side
+PROFILE_SCORES = ["opening_activity", "opening_aggression", "mid_activity", "mid_aggression"]
+
+
+class LichessFetcher:
+    # Streams a user's games from the Lichess export API as NDJSON, one dict per game with its PGN.
+    # Use as an async context manager so the pooled session is closed:
+    #   async with LichessFetcher() as fetcher:
+    #       async for game in fetcher.iter_games("username"): ...
+    def __init__(self, base_url=LICHESS_URL, token=None, connection_limit=CONNECTION_LIMIT,
+                 rate_limit_wait=RATE_LIMIT_WAIT, max_retries=MAX_RETRIES):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required to fetch games from Lichess")
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.connection_limit = connection_limit
+        self.rate_limit_wait = rate_limit_wait
+        self.max_retries = max_retries
+        self.session = None
+
+    async def __aenter__(self):
+        headers = {"Accept": "application/x-ndjson"}
+        if self.token:
+            headers["Authorization"] = "Bearer " + self.token
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connection_limit),
+                                             headers=headers)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def iter_games(self, username, max_games=None, **params):
+        # Yield each game as soon as its line has arrived, extra params go to the export query (perfType, since, ...)
+        query = {"pgnInJson": "true", "opening": "true", **params}
+        if max_games is not None:
+            query["max"] = str(max_games)
+        url = f"{self.base_url}/api/games/user/{username}"
+
+        for attempt in range(self.max_retries + 1):
+            async with self.session.get(url, params=query) as response:
+                if response.status == 429:
+                    await asyncio.sleep(float(response.headers.get("Retry-After", self.rate_limit_wait * 2 ** attempt)))
+                    continue
+                response.raise_for_status()
+
+                buffer = b""
+                async for data in response.content.iter_any():
+                    buffer += data
+                    if b"\n" not in data:
+                        continue
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        if line.strip():
+                            yield json.loads(line)
+                if buffer.strip():
+                    yield json.loads(buffer)
+                return
+
+        raise RuntimeError(f"Lichess rate limit still hit after {self.max_retries} retries for {username}")
+
+
+def game_opening_headers(game):
+    # The NDJSON opening field in the PGN tag format OpeningBook.game_opening_length reads
+    opening = game.get("opening") or {}
+    return {"ECO": opening.get("eco", ""), "Opening": opening.get("name", "")}
+
+
+async def stream_user_games(fetcher, username, openingBook, executor, max_games=None, max_in_flight=MAX_IN_FLIGHT, **params):
+    # Yield (game, scores) as games are extracted, scores follows BatchExtract.SCORE_COLUMNS.
+    # Each downloaded game is sent to the executor right away, at most max_in_flight are pending
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    async for game in fetcher.iter_games(username, max_games, **params):
+        if game.get("variant", "standard") != "standard":
+            continue
+        openingLength = openingBook.game_opening_length(game_opening_headers(game))
+        if openingLength is None:
+            continue
+
+        if len(pending) >= max_in_flight:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        else:
+            done = {future for future in pending if future.done()}
+            pending -= done
+        for future in done:
+            yield future.result()
+
+        pending.add(asyncio.ensure_future(extract_game(loop, executor, game, openingLength)))
+
+    for future in asyncio.as_completed(pending):
+        yield await future
+
+
+async def extract_game(loop, executor, game, openingLength):
+    # A chunk of one game, its byte offset is only the key of the game in the chunk
+    (_, scores, _, _, _), _, _, _ = await loop.run_in_executor(executor, extract_chunk, [(0, game["pgn"], openingLength)])
+    return game, scores[0].tolist()
+
+
+def player_color(game, username):
+    # "white", "black" or None when username didn't play the game
+    for color in ("white", "black"):
+        if (game["players"][color].get("user") or {}).get("id") == username.lower():
+            return color
+    return None
+
+
+async def build_profile(fetcher, username, openingBook, executor, max_games=None, max_in_flight=MAX_IN_FLIGHT, **params):
+    # Average opening and middlegame scores of the side username played, games without a score are skipped
+    totals = {score: [] for score in PROFILE_SCORES}
+    games = 0
+    async for game, scores in stream_user_games(fetcher, username, openingBook, executor, max_games, max_in_flight, **params):
+        color = player_color(game, username)
+        if color is None:
+            continue
+        games += 1
+        gameScores = dict(zip(SCORE_COLUMNS, scores))
+        for score in PROFILE_SCORES:
+            phase, name = score.split("_")
+            value = gameScores[f"{phase}_{color}_{name}"]
+            if not math.isnan(value):
+                totals[score].append(value)
+
+    profile = {"username": username, "games": games}
+    for score, values in totals.items():
+        profile[score] = math.fsum(values) / len(values) if values else None
+    return profile
+
+
+async def build_profiles(usernames, openingBook, base_url=LICHESS_URL, token=None, workers=None, max_games=None,
+                         max_in_flight=MAX_IN_FLIGHT, **params):
+    # Profiles of several users fetched concurrently over one connection pool and one process pool
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=init_worker,
+                             initargs=(CACHE_ENTRIES,)) as executor:
+        async with LichessFetcher(base_url, token) as fetcher:
+            return await asyncio.gather(*(build_profile(fetcher, username, openingBook, executor, max_games,
+                                                        max_in_flight, **params) for username in usernames))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build playstyle profiles from the Lichess games of users")
+    parser.add_argument("usernames", nargs="+")
+    parser.add_argument("--opening-book", help="CSV snapshot of the opening_book table, the database is used if omitted")
+    parser.add_argument("--base-url", default=LICHESS_URL)
+    parser.add_argument("--token", default=os.environ.get("LICHESS_TOKEN"), help="API token, raises the download rate")
+    parser.add_argument("--max-games", type=int, default=None)
+    parser.add_argument("--perf-type", help="Comma separated speeds, e.g. blitz,rapid")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT)
+    args = parser.parse_args()
+
+    if args.opening_book:
+        openingBook = OpeningBook().load_snapshot(args.opening_book)
+    else:
+        import psycopg2
+        connection = psycopg2.connect('')
+        openingBook = OpeningBook(connection.cursor()).load()
+
+    params = {"perfType": args.perf_type} if args.perf_type else {}
+    profiles = asyncio.run(build_profiles(args.usernames, openingBook, args.base_url, args.token, args.workers,
+                                          args.max_games, args.max_in_flight, **params))
+    print(json.dumps(profiles, indent=2))
@@ -0,0 +1,121 @@
+import argparse
+import io
+import time
+import chess_app
+import chess.pgn
+import numpy as np
+from array import array
+from FeatureExtractor import FeatureExtractor
+from OpeningBook import OpeningBook
+import chess_app.database.ParsePGN as ParsePGN
+
+# Moves are stored as uint16: from square | to square << 6 | promotion piece type << 12 (0 = none).
+# A move store is an .npz written once per database dump, its moves are replayed without parsing SAN
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    return chess_app.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+def encode_moves(moves):
+    return array('H', map(encode_move, moves))
+
+
+def decode_moves(codes):
+    return list(map(decode_move, map(int, codes)))
+
+
+def write_move_store(pgn_file_path, output_path, openingBook, headerFilter=None):
+    # Parse every game once and store its mainline, starting FEN and opening length. Games without a
+    # known opening length are left out, like in BatchExtract
+    byte_offsets = array('q')
+    openingLengths = array('h')
+    moveStarts = array('q', [0])
+    moves = array('H')
+    fens = []
+
+    for byte_offset, _, tags, movetext in ParsePGN.iter_games(pgn_file_path, accept=headerFilter):
+        openingLength = openingBook.game_opening_length(tags)
+        if openingLength is None:
+            continue
+        game = chess.pgn.read_game(io.StringIO(ParsePGN.game_text(tags, movetext)))
+
+        byte_offsets.append(byte_offset)
+        openingLengths.append(openingLength)
+        moves.extend(encode_moves(game.mainline_moves()))
+        moveStarts.append(len(moves))
+        fens.append(tags.get("FEN", ""))
+
+    np.savez_compressed(output_path,
+                        byte_offset=np.frombuffer(byte_offsets, dtype=np.int64),
+                        opening_length=np.frombuffer(openingLengths, dtype=np.int16),
+                        move_start=np.frombuffer(moveStarts, dtype=np.int64),
+                        moves=np.frombuffer(moves, dtype=np.uint16),
+                        fen=np.array(fens, dtype=str))
+    return len(byte_offsets)
+
+
+def iter_move_store(store_path):
+    # (byte_offset, fen or None, uint16 move codes, openingLength) for every game of a move store
+    with np.load(store_path) as store:
+        byte_offsets = store["byte_offset"]
+        openingLengths = store["opening_length"]
+        moveStarts = store["move_start"]
+        moves = store["moves"]
+        fens = store["fen"]
+
+    for i, byte_offset in enumerate(byte_offsets.tolist()):
+        yield byte_offset, str(fens[i]) or None, moves[moveStarts[i]:moveStarts[i + 1]], int(openingLengths[i])
+
+
+def verify_move_store(pgn_file_path, store_path, limit=None):
+    # Extract games both from the PGN and by replaying the store, returns the byte offsets that differ
+    stored = {byte_offset: (fen, codes, openingLength)
+              for byte_offset, fen, codes, openingLength in iter_move_store(store_path)}
+    mismatches = []
+    checked = 0
+    for byte_offset, _, tags, movetext in ParsePGN.iter_games(pgn_file_path):
+        if byte_offset not in stored:
+            continue
+        fen, codes, openingLength = stored[byte_offset]
+
+        parsed = FeatureExtractor(chess.pgn.read_game(io.StringIO(ParsePGN.game_text(tags, movetext))), openingLength)
+        replayed = FeatureExtractor.from_moves(decode_moves(codes), openingLength, fen)
+        if (parsed.extract_features() != replayed.extract_features() or
+                parsed.openingFeatures != replayed.openingFeatures or parsed.midFeatures != replayed.midFeatures):
+            mismatches.append(byte_offset)
+
+        checked += 1
+        if limit is not None and checked >= limit:
+            break
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or verify the pre-decoded move store of a PGN file")
+    parser.add_argument("command", choices=["build", "verify"])
+    parser.add_argument("pgn", help="PGN file, .zst/.bz2/.gz dumps are read as a stream")
+    parser.add_argument("store", help="Move store .npz")
+    parser.add_argument("--opening-book", help="CSV snapshot of the opening_book table, the database is used if omitted")
+    parser.add_argument("--limit", type=int, default=None, help="Games to verify, all if omitted")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        if args.opening_book:
+            openingBook = OpeningBook().load_snapshot(args.opening_book)
+        else:
+            import psycopg2
+            connection = psycopg2.connect('')
+            openingBook = OpeningBook(connection.cursor()).load()
+        games = write_move_store(args.pgn, args.store, openingBook)
+        print(f"Stored {games} games in {time.perf_counter() - start:.1f}s")
+    else:
+        mismatches = verify_move_store(args.pgn, args.store, args.limit)
+        print(f"{len(mismatches)} mismatches in {time.perf_counter() - start:.1f}s")
+        for byte_offset in mismatches[:20]:
+            print(byte_offset)
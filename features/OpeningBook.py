@@ -0,0 +1,70 @@
+import csv
+
+
+class OpeningBook:
+    # In-memory copy of the opening_book table, (eco, opening, variation) -> opening_move_length.
+    # Loaded once from the database or a local snapshot, misses fall back to a query when a cursor is given
+    def __init__(self, cursor=None):
+        self.cursor = cursor
+        self.lengths = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        self.cursor.execute("""
+            SELECT eco_code, opening_name, variation_name, opening_move_length
+            FROM opening_book
+            """)
+        for eco_code, opening_name, variation_name, opening_move_length in self.cursor.fetchall():
+            self.lengths[(eco_code, opening_name, variation_name)] = opening_move_length
+        return self
+
+    def load_snapshot(self, snapshot_path):
+        with open(snapshot_path, newline='', encoding="utf-8") as snapshotFile:
+            for eco_code, opening_name, variation_name, opening_move_length in csv.reader(snapshotFile):
+                self.lengths[(eco_code, opening_name, variation_name)] = int(opening_move_length)
+        return self
+
+    def save_snapshot(self, snapshot_path):
+        # Openings that were looked up but aren't in the book aren't written
+        with open(snapshot_path, 'w', newline='', encoding="utf-8") as snapshotFile:
+            writer = csv.writer(snapshotFile)
+            for key, opening_move_length in self.lengths.items():
+                if opening_move_length is not None:
+                    writer.writerow(key + (opening_move_length,))
+
+    def opening_length(self, eco_code, opening_name, variation_name):
+        key = (eco_code, opening_name, variation_name)
+        if key in self.lengths:
+            self.hits += 1
+            return self.lengths[key]
+
+        self.misses += 1
+        opening_move_length = None
+        if self.cursor is not None:
+            self.cursor.execute("""
+                SELECT opening_move_length
+                FROM opening_book
+                WHERE eco_code = %s AND opening_name = %s AND variation_name = %s
+                """, key)
+            row = self.cursor.fetchone()
+            if row is not None:
+                opening_move_length = row[0]
+
+        # Unknown openings are cached too so they are only queried once
+        self.lengths[key] = opening_move_length
+        return opening_move_length
+
+    def game_opening_length(self, headers):
+        # Lichess names openings as "Opening: Variation"
+        opening_name, _, variation_name = headers.get("Opening", "").partition(": ")
+        return self.opening_length(headers.get("ECO", ""), opening_name, variation_name)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.lengths),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,101 @@
+import bisect
+import csv
+import math
+import os
+import pickle
+
+# Values kept per (player, color, ECO), the scores of the player's side of each game
+AGGREGATE_SCORES = ["opening_activity", "opening_aggression", "mid_activity", "mid_aggression"]
+
+
+class PlayerAggregator:
+    # Running count, mean and variance of each score per (player, color, ECO), updated one game at a time
+    # (Welford) so no game is kept. Aggregators built in different processes are combined with merge (Chan et al.)
+    # and saved with checkpoint. NaN scores (games that end before the opening boundary) are not counted.
+    # offset and ranges record which games of the file are folded in, so a run can resume from a checkpoint
+    def __init__(self):
+        # (player, color, eco) -> [counts, means, m2s], one list entry per AGGREGATE_SCORES
+        self.stats = {}
+        self.games = 0
+        # Every game before this byte offset is folded in or was never extracted (filtered out)
+        self.offset = 0
+        # Sorted (first, last) byte offsets of the game runs past offset that are folded in
+        self.ranges = []
+
+    def __len__(self):
+        return len(self.stats)
+
+    def add(self, player, color, eco, values):
+        key = (player, color, eco)
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = self.stats[key] = [[0] * len(AGGREGATE_SCORES), [0.0] * len(AGGREGATE_SCORES), [0.0] * len(AGGREGATE_SCORES)]
+        counts, means, m2s = entry
+
+        for i, value in enumerate(values):
+            if math.isnan(value):
+                continue
+            counts[i] += 1
+            delta = value - means[i]
+            means[i] += delta / counts[i]
+            m2s[i] += delta * (value - means[i])
+
+    def add_game(self, white, black, eco, scores):
+        # scores in BatchExtract.SCORE_COLUMNS order
+        (openingWhiteActivity, openingBlackActivity, openingWhiteAggression, openingBlackAggression,
+         midWhiteActivity, midBlackActivity, midWhiteAggression, midBlackAggression) = scores
+        self.add(white, "white", eco, (openingWhiteActivity, openingWhiteAggression, midWhiteActivity, midWhiteAggression))
+        self.add(black, "black", eco, (openingBlackActivity, openingBlackAggression, midBlackActivity, midBlackAggression))
+        self.games += 1
+
+    def includes(self, byte_offset):
+        # True when the game at byte_offset is already folded in
+        if byte_offset < self.offset:
+            return True
+        i = bisect.bisect_right(self.ranges, (byte_offset, math.inf)) - 1
+        return i >= 0 and self.ranges[i][0] <= byte_offset <= self.ranges[i][1]
+
+    def merge(self, other):
+        for key, (otherCounts, otherMeans, otherM2s) in other.stats.items():
+            entry = self.stats.get(key)
+            if entry is None:
+                self.stats[key] = [otherCounts[:], otherMeans[:], otherM2s[:]]
+                continue
+            counts, means, m2s = entry
+            for i, otherCount in enumerate(otherCounts):
+                if not otherCount:
+                    continue
+                count = counts[i] + otherCount
+                delta = otherMeans[i] - means[i]
+                means[i] += delta * otherCount / count
+                m2s[i] += otherM2s[i] + delta * delta * counts[i] * otherCount / count
+                counts[i] = count
+        self.games += other.games
+        return self
+
+    def rows(self):
+        # (player, color, eco, score, count, mean, variance) with the sample variance, NaN below 2 games
+        for (player, color, eco), (counts, means, m2s) in self.stats.items():
+            for i, score in enumerate(AGGREGATE_SCORES):
+                if counts[i]:
+                    yield player, color, eco, score, counts[i], means[i], m2s[i] / (counts[i] - 1) if counts[i] > 1 else math.nan
+
+    def write_csv(self, output_csv):
+        with open(output_csv, 'w', newline='', encoding="utf-8") as csvFile:
+            writer = csv.writer(csvFile)
+            writer.writerow(["player", "color", "eco", "score", "count", "mean", "variance"])
+            writer.writerows(self.rows())
+
+    def checkpoint(self, checkpoint_path):
+        # Written next to the target and renamed over it, a crash never leaves a partial checkpoint
+        tempPath = checkpoint_path + ".tmp"
+        with open(tempPath, "wb") as checkpointFile:
+            pickle.dump((self.games, self.stats, self.offset, self.ranges), checkpointFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempPath, checkpoint_path)
+
+    @classmethod
+    def load(cls, checkpoint_path):
+        aggregator = cls()
+        with open(checkpoint_path, "rb") as checkpointFile:
+            aggregator.games, aggregator.stats, aggregator.offset, aggregator.ranges = pickle.load(checkpointFile)
+        return aggregator
@@ -0,0 +1,73 @@
+import sys
+from collections import OrderedDict
+
+
+class PositionCache:
+    # Bounded LRU cache of per-position results keyed by position (see FeatureExtractor.positionKey). One
+    # instance can be shared by every FeatureExtractor of a worker so positions repeated across games are only
+    # analysed once. maxBytes is checked against an approximate size of the stored keys and values
+    def __init__(self, maxEntries=1000000, maxBytes=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.bytes -= self.sizes[key]
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        size = self._entry_size(key, value)
+        self.sizes[key] = size
+        self.bytes += size
+
+        while len(self.entries) > self.maxEntries or (self.maxBytes is not None and self.bytes > self.maxBytes):
+            oldKey, _ = self.entries.popitem(last=False)
+            self.bytes -= self.sizes.pop(oldKey)
+            self.evictions += 1
+
+    @staticmethod
+    def _entry_size(key, value):
+        # Containers, their items and the items of nested tuples (the position key, delta pairs),
+        # plus the dict slots of entries and sizes
+        size = 2 * 100 + sys.getsizeof(key) + sys.getsizeof(value)
+        for item in (*key, *value):
+            size += sys.getsizeof(item)
+            if isinstance(item, tuple):
+                size += sum(map(sys.getsizeof, item))
+        return size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def combine_stats(workerStats):
+    # Totals of several caches' stats(), e.g. the last report of every worker process
+    totals = {name: sum(stats[name] for stats in workerStats) for name in ("entries", "bytes", "hits", "misses", "evictions")}
+    lookups = totals["hits"] + totals["misses"]
+    totals["hitRate"] = totals["hits"] / lookups if lookups else 0.0
+    return totals
@@ -0,0 +1,84 @@
+from FeatureExtractor import FeatureExtractor
+
+
+class TrieNode:
+    __slots__ = ("children", "games")
+
+    def __init__(self):
+        # move -> TrieNode
+        self.children = {}
+        # Keys of the games whose mainline ends at this node
+        self.games = []
+
+
+class PrefixTrie:
+    # Move trie of a batch of games. Games with the same starting position and opening length share
+    # a root, every move prefix they have in common is analysed once and the FeatureExtractor state
+    # is cloned where their mainlines diverge. Results are the same as extracting each game on its own
+    def __init__(self, positionCache=None, profiler=None):
+        self.positionCache = positionCache
+        self.profiler = profiler
+        # (openingLength, starting FEN) -> (first game, root TrieNode)
+        self.roots = {}
+        self.gameCount = 0
+        self.nodeCount = 0
+
+    def add(self, key, game, openingLength, moves=None):
+        # moves replaces the game's mainline, e.g. decoded from a move store for a header-only game
+        rootKey = (openingLength, game.board().fen())
+        if rootKey not in self.roots:
+            self.roots[rootKey] = (game, TrieNode())
+        node = self.roots[rootKey][1]
+
+        for move in game.mainline_moves() if moves is None else moves:
+            child = node.children.get(move)
+            if child is None:
+                child = node.children[move] = TrieNode()
+                self.nodeCount += 1
+            node = child
+        node.games.append(key)
+        self.gameCount += 1
+
+    def extract(self):
+        # {key: (extract_features result, openingFeatures, midFeatures)} for every game added
+        results = {}
+        for (openingLength, _), (game, root) in self.roots.items():
+            extractor = FeatureExtractor(game, openingLength, self.positionCache, self.profiler)
+            extractor._start()
+
+            # Depth first so only the states of pending branch points are alive at once
+            stack = [(root, extractor)]
+            while stack:
+                node, extractor = stack.pop()
+
+                # Past the endgame no move changes the result, the whole subtree shares it
+                if extractor.stopped:
+                    finished = (extractor._finish(), extractor.openingFeatures, extractor.midFeatures)
+                    subtree = [node]
+                    sharedGames = 0
+                    while subtree:
+                        descendant = subtree.pop()
+                        for key in descendant.games:
+                            results[key] = finished
+                            sharedGames += 1
+                        subtree.extend(descendant.children.values())
+                    # _finish counted one of them
+                    if extractor.profiler is not None:
+                        for _ in range(sharedGames - 1):
+                            extractor.profiler.count_game()
+                    continue
+
+                # Every game ending here and every child needs its own state, the last one takes the original
+                users = len(node.games) + len(node.children)
+                for key in node.games:
+                    users -= 1
+                    finished = extractor.clone() if users else extractor
+                    results[key] = (finished._finish(), finished.openingFeatures, finished.midFeatures)
+
+                for move, child in node.children.items():
+                    users -= 1
+                    childExtractor = extractor.clone() if users else extractor
+                    childExtractor._step(move)
+                    stack.append((child, childExtractor))
+
+        return results
@@ -0,0 +1,86 @@
+import json
+import time
+from collections import Counter, defaultdict
+
+# FeatureExtractor methods timed when a Profiler is attached
+EXTRACTOR_METHODS = ["_count_move", "_count_pawn_breaks", "_count_unique_attacks", "_count_infiltrations",
+                     "_count_king_attacks", "_count_xray_attacks", "_count_piece_movement", "_count_active_defends",
+                     "_count_patient_moves", "_count_pieces_at_home", "_calculate_control",
+                     "_calculate_central_control", "_calculate_space_advantage", "_detect_pawn_storm"]
+
+# Board and AttackState operations timed, reported as "board.gives_check", "attackState.attackers", ...
+# board.push isn't wrapped: gives_check pushes and pops through it, so its calls wouldn't be plies.
+# Every ply is pushed by attackState.push
+BOARD_METHODS = ["gives_check", "attackers"]
+ATTACK_STATE_METHODS = ["push", "attackers", "attack_unions"]
+
+
+class Profiler:
+    # Opt-in call counts and cumulative time of the FeatureExtractor hot path. Methods are wrapped on
+    # the instances passed to instrument(), so extractors without a profiler run the plain methods.
+    # Times are inclusive: _count_move contains the counters it calls and attackState.push contains board.push
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = defaultdict(float)
+        # Plies processed per phase ("opening", "middlegame")
+        self.plies = Counter()
+        self.games = 0
+
+    def instrument(self, extractor):
+        for name in EXTRACTOR_METHODS:
+            self._wrap(extractor, name, name)
+        for name in BOARD_METHODS:
+            self._wrap(extractor.board, name, "board." + name)
+        for name in ATTACK_STATE_METHODS:
+            self._wrap(extractor.attackState, name, "attackState." + name)
+
+    def _wrap(self, obj, name, label):
+        # Bind the class function so a copied instance dict never calls into another object
+        method = getattr(type(obj), name).__get__(obj)
+        calls = self.calls
+        seconds = self.seconds
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds[label] += perf_counter() - start
+                calls[label] += 1
+
+        setattr(obj, name, timed)
+
+    def count_ply(self, phase):
+        self.plies[phase] += 1
+
+    def count_game(self):
+        self.games += 1
+
+    def merge(self, other):
+        # other is a Profiler or a dict from to_dict(), e.g. the report of a worker process
+        if isinstance(other, Profiler):
+            other = other.to_dict()
+        for label, stats in other["methods"].items():
+            self.calls[label] += stats["calls"]
+            self.seconds[label] += stats["seconds"]
+        self.plies.update(other["plies"])
+        self.games += other["games"]
+        return self
+
+    def reset(self):
+        self.calls.clear()
+        self.seconds.clear()
+        self.plies.clear()
+        self.games = 0
+
+    def to_dict(self):
+        # Methods sorted by cumulative time, slowest first
+        methods = {label: {"calls": self.calls[label], "seconds": self.seconds[label],
+                           "microsecondsPerCall": 1e6 * self.seconds[label] / self.calls[label] if self.calls[label] else 0.0}
+                   for label in sorted(self.seconds, key=self.seconds.get, reverse=True)}
+        return {"games": self.games, "plies": dict(self.plies), "methods": methods}
+
+    def export_json(self, path):
+        with open(path, "w", encoding="utf-8") as reportFile:
+            json.dump(self.to_dict(), reportFile, indent=2)
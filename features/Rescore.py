@@ -0,0 +1,39 @@
+import argparse
+import time
+import numpy as np
+from ScoreCalculator import FEATURE_NAMES, ScoreCalculator, load_weights
+from BatchExtract import SCORE_COLUMNS
+
+
+def rescore(results_path, output_path, weights=None):
+    # Recompute every score of a BatchExtract results file from its stored feature rows, no game is replayed
+    with np.load(results_path) as results:
+        columns = {name: results[name] for name in results.files}
+
+    if list(columns["feature_names"]) != FEATURE_NAMES:
+        raise ValueError("The results file was written with a different feature layout: " + results_path)
+
+    # (N, color, score) for each phase, colors are indexed BLACK = 0, WHITE = 1
+    opening = ScoreCalculator.score_batch(columns["opening_features"], weights)
+    mid = ScoreCalculator.score_batch(columns["mid_features"], weights)
+
+    # Same order as SCORE_COLUMNS
+    rescored = [opening[:, 1, 0], opening[:, 0, 0], opening[:, 1, 1], opening[:, 0, 1],
+                mid[:, 1, 0], mid[:, 0, 0], mid[:, 1, 1], mid[:, 0, 1]]
+    for name, values in zip(SCORE_COLUMNS, rescored):
+        columns[name] = values
+
+    np.savez_compressed(output_path, **columns)
+    return len(columns["byte_offset"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore BatchExtract results with new weights")
+    parser.add_argument("results", help="Results .npz written by BatchExtract")
+    parser.add_argument("output", help="Output .npz, same layout with the scores recomputed")
+    parser.add_argument("--weights", help="JSON weights in the ScoreCalculator.DEFAULT_WEIGHTS format, defaults if omitted")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    games = rescore(args.results, args.output, load_weights(args.weights) if args.weights else None)
+    print(f"Rescored {games} games in {time.perf_counter() - start:.2f}s")
@@ -1,71 +1,99 @@
+import json
+import numpy as np
+
+# Feature layout shared with FeatureExtractor, each color has one row of NUM_FEATURES values.
+# Rows are indexed by color like python-chess (BLACK = 0, WHITE = 1)
+FEATURE_NAMES = ["PawnBreaks", "Attacks",
+                 # Used for Aggro Score
+                 "Infiltrations", "KingAttacks", "XrayAttacks", "PawnStorms",
+                 # Aggro Penalties
+                 "Retreats", "PatientMoves",
+                 # Used for Activity Score
+                 "PieceMoves", "ActiveDefense", "CentralControl", "SpaceAdvantage", "PiecesAtHome",
+                 # Usefulness determines preference for early castling
+                 "CastleTurn"]
+
+(PAWN_BREAKS, ATTACKS,
+ INFILTRATIONS, KING_ATTACKS, XRAY_ATTACKS, PAWN_STORMS,
+ RETREATS, PATIENT_MOVES,
+ PIECE_MOVES, ACTIVE_DEFENSE, CENTRAL_CONTROL, SPACE_ADVANTAGE, PIECES_AT_HOME,
+ CASTLE_TURN) = range(len(FEATURE_NAMES))
+
+NUM_FEATURES = len(FEATURE_NAMES)
+
+# Columns of the weight matrix
+SCORE_NAMES = ["activity", "aggression"]
+
+DEFAULT_WEIGHTS = {
+    "activity": {
+        "PawnBreaks": 1.5,
+        "Attacks": 1.5,
+        "PieceMoves": 1.5,
+        "ActiveDefense": 1.0,
+        "CentralControl": 1.5,
+        "SpaceAdvantage": 1.5,
+        "PiecesAtHome": -0.5,
+    },
+    "aggression": {
+        "PawnBreaks": 1.5,
+        "Attacks": 1.5,
+        "Infiltrations": 2.5,
+        "KingAttacks": 4.5,
+        "XrayAttacks": 3.0,
+        "PawnStorms": 4.0,
+        "Retreats": -2.0,
+        "PatientMoves": -1.0,
+    },
+}
+
+
+def weight_matrix(weights=None):
+    # NUM_FEATURES x len(SCORE_NAMES) matrix from {score: {feature: weight}}, missing features weigh 0
+    weights = DEFAULT_WEIGHTS if weights is None else weights
+    matrix = np.zeros((NUM_FEATURES, len(SCORE_NAMES)))
+    for column, score in enumerate(SCORE_NAMES):
+        for feature, weight in weights[score].items():
+            matrix[FEATURE_NAMES.index(feature), column] = weight
+    return matrix
+
+
+def load_weights(weights_path):
+    # Weights stored as JSON in the DEFAULT_WEIGHTS format
+    with open(weights_path, encoding="utf-8") as weightsFile:
+        return json.load(weightsFile)
+
+
+DEFAULT_WEIGHT_MATRIX = weight_matrix()
+
 
 class ScoreCalculator:
-    def __init__(self, features):
-        self.features = features
+    def __init__(self, features, weights=None):
+        # features is a (2, NUM_FEATURES) per-color array, weights a weight dict or a precomputed weight_matrix
+        self.features = np.asarray(features, dtype=np.float64)
+        if weights is None:
+            self.weights = DEFAULT_WEIGHT_MATRIX
+        elif isinstance(weights, dict):
+            self.weights = weight_matrix(weights)
+        else:
+            self.weights = weights
+        self.scores = self.features @ self.weights
+
+    @staticmethod
+    def score_batch(features, weights=None):
+        # Score any (..., NUM_FEATURES) array of feature rows in one product, returns (..., len(SCORE_NAMES))
+        if weights is None:
+            weights = DEFAULT_WEIGHT_MATRIX
+        elif isinstance(weights, dict):
+            weights = weight_matrix(weights)
+        return np.asarray(features, dtype=np.float64) @ weights
 
     def activity_score(self):
-        # Weight assignments for the activity score
-        pawn_break_weight = 1.5
-        attacks_weight = 1.5
-        piece_moves_weight = 1.5
-        active_defense_weight = 1.0  
-        central_control_weight = 1.5
-        space_advantage_weight = 1.5
-        piece_at_home_penalty = -0.5
-
-        # Calculate activity scores for white
-        white_activity = (pawn_break_weight * self.features["whitePawnBreaks"] +
-                          attacks_weight * self.features["whiteAttacks"] + 
-                          piece_moves_weight * self.features["whitePieceMoves"] + 
-                          active_defense_weight * self.features["whiteActiveDefense"] +
-                          central_control_weight * self.features["whiteCentralControl"] +
-                          space_advantage_weight * self.features["whiteSpaceAdvantage"] +
-                          piece_at_home_penalty * self.features["whitePiecesAtHome"])
-
-        # Calculate activity scores for black
-        black_activity = (pawn_break_weight * self.features["blackPawnBreaks"] +
-                          attacks_weight * self.features["blackAttacks"] + 
-                          piece_moves_weight * self.features["blackPieceMoves"] + 
-                          active_defense_weight * self.features["blackActiveDefense"] +
-                          central_control_weight * self.features["blackCentralControl"] +
-                          space_advantage_weight * self.features["blackSpaceAdvantage"] +
-                          piece_at_home_penalty * self.features["blackPiecesAtHome"])
-
-        return white_activity, black_activity
+        # Activity scores for white and black
+        return float(self.scores[1, 0]), float(self.scores[0, 0])
 
     def aggression_score(self):
-        # Weight assignments for the aggression score
-        pawn_breaks_weight = 1.5
-        attacks_weight = 1.5  
-
-        infiltration_weight = 2.5  
-        king_attack_weight = 4.5  
-        xray_attacks_weight = 3.0  
-        pawn_storm_weight = 4.0  
-        retreat_penalty = -2.0 
-        patient_move_penalty = -1.0 
-
-        # Calculate aggression scores for white
-        white_aggressiveness = (pawn_breaks_weight * self.features["whitePawnBreaks"] +
-                                attacks_weight * self.features["whiteAttacks"] + 
-                                infiltration_weight * self.features["whiteInfiltrations"] +
-                                king_attack_weight * self.features["whiteKingAttacks"] +
-                                xray_attacks_weight * self.features["whiteXrayAttacks"] +
-                                pawn_storm_weight * self.features["whitePawnStorms"] +
-                                retreat_penalty * self.features["whiteRetreats"] + 
-                                patient_move_penalty * self.features["whitePatientMoves"])
-
-        # Calculate aggression scores for black
-        black_aggressiveness = (pawn_breaks_weight * self.features["blackPawnBreaks"] +
-                                attacks_weight * self.features["blackAttacks"] + 
-                                infiltration_weight * self.features["blackInfiltrations"] +
-                                king_attack_weight * self.features["blackKingAttacks"] +
-                                xray_attacks_weight * self.features["blackXrayAttacks"] +
-                                pawn_storm_weight * self.features["blackPawnStorms"] +
-                                retreat_penalty * self.features["blackRetreats"] + 
-                                patient_move_penalty * self.features["blackPatientMoves"])
-
-        return white_aggressiveness, black_aggressiveness
+        # Aggression scores for white and black
+        return float(self.scores[1, 1]), float(self.scores[0, 1])
 
     def calculate_all_scores(self):
         # Calculate and return all scores at once
@@ -77,4 +105,4 @@ class ScoreCalculator:
             "black_activity": black_activity,
             "white_aggressiveness": white_aggressiveness,
             "black_aggressiveness": black_aggressiveness
-        }
\ No newline at end of file
+        }
@@ -16,11 +16,15 @@ class Utilities:
         return white_pieces + black_pieces <= 6
     
     @staticmethod
-    def is_retreating_from_attack(board, fromSq, toSq, movingPiece):
+    def is_retreating_from_attack(board, fromSq, toSq, movingPiece, attackState=None):
         if movingPiece.piece_type in [chess_app.PAWN, chess_app.KING]:
             return False
         
-        attackers = board.attackers(not movingPiece.color, fromSq)
+        # Read the attackers from the shared AttackState when the caller keeps one
+        if attackState is not None:
+            attackers = attackState.attackers(not movingPiece.color, fromSq)
+        else:
+            attackers = board.attackers(not movingPiece.color, fromSq)
         if not attackers:
             return False
 
@@ -33,19 +37,3 @@ class Utilities:
         new_distances = [square_distance(toSq, attacker) for attacker in attackers]
         
         return current_distances < new_distances
-
-    @staticmethod
-    def get_prev_n_moves(board, n):
-        prevMoves = []
-        if n > len(board.move_stack):
-            return prevMoves 
-        
-        for _ in range(min(n, len(board.move_stack))):
-            move = board.pop()
-            prevMoves.append(move)
-
-        prevMoves.reverse()
-        for move in prevMoves:
-            board.push(move)
-
-        return prevMoves
\ No newline at end of file
@@ -1,38 +1,43 @@
 from FeatureExtractor import FeatureExtractor
 from ScoreCalculator import ScoreCalculator
+from OpeningBook import OpeningBook
+import chess.pgn
 import psycopg2
 import chess_app.database.ParsePGN as ParsePGN
 
 connection = psycopg2.connect('')
 cursor = connection.cursor()
 
+# Plain .pgn files and .zst/.bz2/.gz dumps are both read as a stream
 pgn = r"C:\Users\DELL\IdeaProjects\django\out.pgn"
 
 ParsePGN.parse_pgn_update_db(pgn, cursor)
 
-        
+# The whole opening_book table is loaded once, games only query the database on a miss
+openingBook = OpeningBook(cursor).load()
 
 
-cursor.execute("""
-    SELECT opening_move_length 
-    FROM opening_book
-    WHERE eco_code = %s AND opening_name = %s AND variation_name = %s
-    """, (eco_code, opening_name, variation_name))
+with ParsePGN.open_pgn_text(pgn) as pgnFile:
+    while True:
+        game = chess.pgn.read_game(pgnFile)
+        if game is None:
+            break
 
-# openingLength = cursor.fetchone() 
+        openingLength = openingBook.game_opening_length(game.headers)
+        if openingLength is None:
+            continue
 
+        features = FeatureExtractor(game, openingLength)
 
+        opAct, opAggro, midAct, midAggro, zobristHashOpening = features.extract_features()
 
+        print(opAct, opAggro)
 
-# cursor.close()
-# connection.close()
+        print(midAct, midAggro)
 
-# features = FeatureExtractor(game, openingLength[0])
+        print(zobristHashOpening)
 
-# opAct, opAggro, midAct, midAggro, zobristHashOpening = features.extract_features()
+print(openingBook.stats())
 
-# print(opAct, opAggro)
-
-# print(midAct, midAggro)
-
-# print(zobristHashOpening)
+cursor.close()
+connection.close()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The features and database modules import their siblings by name, like when they are run as scripts
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("features", "database"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
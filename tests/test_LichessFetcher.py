@@ -0,0 +1,108 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+# aiohttp is optional, the module under test is imported directly so a broken import fails the tests
+web = pytest.importorskip("aiohttp.web")
+test_utils = pytest.importorskip("aiohttp.test_utils")
+import LichessFetcher
+from OpeningBook import OpeningBook
+
+PGN = """[Event "Rated Blitz game"]
+[White "alice"]
+[Black "bob"]
+[Result "1-0"]
+[ECO "C50"]
+[Opening "Italian Game: Giuoco Piano"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. c3 Nf6 5. d4 exd4 6. cxd4 Bb4+ 7. Nc3 Nxe4 8. O-O Bxc3 1-0
+"""
+
+
+def lichess_game(gameId, variant="standard"):
+    return {"id": gameId, "variant": variant, "opening": {"eco": "C50", "name": "Italian Game: Giuoco Piano"},
+            "players": {"white": {"user": {"id": "alice"}}, "black": {"user": {"id": "bob"}}}, "pgn": PGN}
+
+
+async def serve(games, rate_limited=1):
+    # Export endpoint answering the first rate_limited requests with a 429, then streaming the games as NDJSON
+    # cut in the middle of lines so a line always spans two reads. The last line has no newline, like Lichess
+    requests = []
+
+    async def export(request):
+        requests.append(request)
+        if len(requests) <= rate_limited:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        body = "\n".join(json.dumps(game) for game in games).encode()
+        for start in range(0, len(body), 97):
+            await response.write(body[start:start + 97])
+            await asyncio.sleep(0.01)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/api/games/user/{username}", export)
+    server = test_utils.TestServer(app)
+    await server.start_server()
+    return server, requests
+
+
+def run(coroutine):
+    # A wait on the fetcher's default one minute backoff fails the test instead of hanging it
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+
+def test_iter_games_waits_retry_after_and_joins_split_lines():
+    games = [lichess_game(f"game{i}") for i in range(5)]
+
+    async def fetch():
+        server, requests = await serve(games)
+        try:
+            async with LichessFetcher.LichessFetcher(str(server.make_url("")), rate_limit_wait=3600) as fetcher:
+                return [game async for game in fetcher.iter_games("alice", max_games=5)], requests
+        finally:
+            await server.close()
+
+    fetched, requests = run(fetch())
+    assert fetched == games
+    assert len(requests) == 2
+    assert requests[-1].query["max"] == "5"
+
+
+def test_iter_games_gives_up_after_max_retries():
+    async def fetch():
+        server, _ = await serve([], rate_limited=3)
+        try:
+            async with LichessFetcher.LichessFetcher(str(server.make_url("")), max_retries=2) as fetcher:
+                return [game async for game in fetcher.iter_games("alice")]
+        finally:
+            await server.close()
+
+    with pytest.raises(RuntimeError):
+        run(fetch())
+
+
+def test_stream_user_games_skips_other_variants():
+    games = [lichess_game("standard1"), lichess_game("chess960", "chess960"), lichess_game("standard2")]
+    openingBook = OpeningBook()
+    openingBook.lengths[("C50", "Italian Game", "Giuoco Piano")] = 8
+
+    async def stream():
+        server, _ = await serve(games)
+        try:
+            async with LichessFetcher.LichessFetcher(str(server.make_url(""))) as fetcher:
+                return [result async for result in LichessFetcher.stream_user_games(fetcher, "alice", openingBook, executor)]
+        finally:
+            await server.close()
+
+    # extract_chunk runs in threads here, they share the worker state init_worker sets once
+    LichessFetcher.init_worker(0)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        streamed = run(stream())
+
+    assert sorted(game["id"] for game, _ in streamed) == ["standard1", "standard2"]
+    for _, scores in streamed:
+        assert len(scores) == len(LichessFetcher.SCORE_COLUMNS)
@@ -0,0 +1,148 @@
+import os
+import uuid
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+ParsePGN = pytest.importorskip("ParsePGN")
+
+# Connection string of a database the test may write to, the tables are created in a schema dropped afterwards
+TEST_DSN = os.environ.get("TEST_DATABASE_DSN")
+
+PGN = """[Event "Rated Blitz game"]
+[Site "https://lichess.org/abc"]
+[White "alice"]
+[Black "bob, \\"the\\" rook"]
+[Result "1-0"]
+[Date "2024.01.02"]
+[ECO "C50"]
+[Opening "Italian Game"]
+
+1. e4 e5 2. Nf3 { a "quoted", comment
+[%clk 0:03:00] } Nc6 3. Bc4 Bc5
+4. c3 Nf6 1-0
+
+[Event "Casual game"]
+[White "carol"]
+[Black "bob, \\"the\\" bishop"]
+[Result "*"]
+
+1. d4 *
+
+[Event "Rated Rapid game"]
+[White "bob, \\"the\\" rook"]
+[Black "carol"]
+[Result "0-1"]
+[Date "2024.01.03"]
+[ECO "A00"]
+[Opening "Polish Opening"]
+
+1. b4 e5 2. Bb2 Bxb4
+3. Bxe5 Nf6 0-1
+"""
+
+GAMES = """
+    SELECT g.byte_offset, w.name, b.name, o.eco_code, o.opening_name, g.game_date, g.result, g.movetext
+    FROM games g
+    JOIN players w ON w.id = g.white_id
+    JOIN players b ON b.id = g.black_id
+    JOIN openings o ON o.id = g.opening_id
+    ORDER BY g.byte_offset
+    """
+
+
+@pytest.fixture
+def cursor():
+    if not TEST_DSN:
+        pytest.skip("TEST_DATABASE_DSN is not set")
+    connection = psycopg2.connect(TEST_DSN)
+    schema = "parse_pgn_test_" + uuid.uuid4().hex
+    cursor = connection.cursor()
+    cursor.execute("CREATE SCHEMA " + schema)
+    cursor.execute("SET search_path TO " + schema)
+    connection.commit()
+    try:
+        yield cursor
+    finally:
+        connection.rollback()
+        cursor.execute("DROP SCHEMA " + schema + " CASCADE")
+        connection.commit()
+        connection.close()
+
+
+@pytest.fixture
+def pgn_path(tmp_path):
+    path = tmp_path / "games.pgn"
+    path.write_bytes(PGN.encode())
+    return str(path)
+
+
+class FailingCursor:
+    # Cursor whose COPY into games fails on the given call, like a load that crashes mid-file
+    def __init__(self, cursor, fail_on):
+        self.cursor = cursor
+        self.fail_on = fail_on
+        self.game_copies = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def copy_expert(self, sql, file):
+        if sql.startswith("COPY games "):
+            self.game_copies += 1
+            if self.game_copies == self.fail_on:
+                raise RuntimeError("load interrupted")
+        return self.cursor.copy_expert(sql, file)
+
+
+# (byte_offset, white, black, eco_code, opening_name, game_date, result, movetext) of the games in PGN
+EXPECTED_GAMES = [
+    (0, "alice", 'bob, "the" rook', "C50", "Italian Game", "2024.01.02", "1-0",
+     '1. e4 e5 2. Nf3 { a "quoted", comment\n[%clk 0:03:00] } Nc6 3. Bc4 Bc5\n4. c3 Nf6 1-0'),
+    (PGN.index('[Event "Casual'), "carol", 'bob, "the" bishop', "", "", "", "*", "1. d4 *"),
+    (PGN.index('[Event "Rated Rapid'), 'bob, "the" rook', "carol", "A00", "Polish Opening", "2024.01.03", "0-1",
+     "1. b4 e5 2. Bb2 Bxb4\n3. Bxe5 Nf6 0-1"),
+]
+
+
+def test_iter_games_unescapes_tag_values(pgn_path):
+    tags = [tags for _, _, tags, _ in ParsePGN.iter_games(pgn_path)]
+    assert [(game["White"], game["Black"]) for game in tags] == [game[1:3] for game in EXPECTED_GAMES]
+    assert ParsePGN.tag_value(b'"back\\\\slash"]') == b"back\\slash"
+    assert ParsePGN.tag_value(b'"unterminated') is None
+
+
+def test_scan_headers_unescapes_tag_values(pgn_path):
+    headers = ParsePGN.scan_headers(pgn_path)
+    players = headers.players.values
+    assert [(players[white], players[black]) for white, black in zip(headers.white, headers.black)] == \
+        [game[1:3] for game in EXPECTED_GAMES]
+
+
+def test_parse_pgn_update_db_copies_games(cursor, pgn_path):
+    assert ParsePGN.parse_pgn_update_db(pgn_path, cursor, batch_size=2) == 3
+
+    cursor.execute(GAMES)
+    # Quoted ids and offsets are read as integers, missing tags as empty strings rather than NULL, and
+    # names that only differ after an escaped quote are different players
+    assert cursor.fetchall() == EXPECTED_GAMES
+
+    cursor.execute("SELECT source_file, byte_offset, games FROM ingest_checkpoints")
+    assert cursor.fetchall() == [("games.pgn", len(PGN), 3)]
+
+
+def test_parse_pgn_update_db_resumes_from_checkpoint(cursor, pgn_path):
+    # batch_size=1 commits every game, the second COPY into games fails so only the first game is kept
+    with pytest.raises(RuntimeError):
+        ParsePGN.parse_pgn_update_db(pgn_path, FailingCursor(cursor, 2), batch_size=1)
+
+    cursor.execute("SELECT byte_offset, games FROM ingest_checkpoints")
+    assert cursor.fetchall() == [(PGN.index('[Event "Casual'), 1)]
+    cursor.execute("SELECT count(*) FROM games")
+    assert cursor.fetchone() == (1,)
+
+    # The rerun starts at the checkpoint, a game loaded twice would break the games primary key
+    assert ParsePGN.parse_pgn_update_db(pgn_path, cursor, batch_size=1) == 3
+    cursor.execute(GAMES)
+    assert cursor.fetchall() == EXPECTED_GAMES
+    cursor.execute("SELECT count(*) FROM players")
+    assert cursor.fetchone() == (4,)